@@ -17,7 +17,6 @@
 import time
 from gettext import gettext as _
 
-from gi.repository import GConf
 from gi.repository import Gtk
 from gi.repository import GLib
 
@@ -30,6 +29,7 @@ class WebService(WebService):
 
     def __init__(self):
         self._service = accountsmanager.get_service('harvest')
+        self._settings = self._service.get_settings()
 
     def get_icon_name(self):
         return 'activity-journal'
@@ -58,12 +58,14 @@ class WebService(WebService):
         desc_label.set_alignment(0, 0)
         form.pack_start(desc_label, True, False, 0)
 
-        host_field = AutoField(_('URL'), self._service.Harvest.HOSTNAME)
+        host_field = AutoField(_('URL'), self._service.Harvest.HOSTNAME,
+                               self._settings)
         label_group.add_widget(host_field.label)
         entry_group.add_widget(host_field.entry)
         form.pack_start(host_field, False, True, 0)
 
-        key_field = AutoField(_('API Key'), self._service.Harvest.API_KEY)
+        key_field = AutoField(_('API Key'), self._service.Harvest.API_KEY,
+                              self._settings)
         key_field.entry.set_visibility(False)
         label_group.add_widget(key_field.label)
         entry_group.add_widget(key_field.entry)
@@ -72,7 +74,8 @@ class WebService(WebService):
         options = [[_('Weekly'), self._service.Harvest.WEEKLY],
                    [_('Monthly'), self._service.Harvest.MONTHLY]]
         frequency_field = ComboField(_('Frequency'), options,
-                                     self._service.Harvest.FREQUENCY)
+                                     self._service.Harvest.FREQUENCY,
+                                     self._settings)
         label_group.add_widget(frequency_field.label)
         entry_group.add_widget(frequency_field.combo)
         form.pack_start(frequency_field, False, True, 0)
@@ -91,7 +94,8 @@ class WebService(WebService):
         collect_field = CollectButtonField(self._service)
         collect_form.pack_start(collect_field, False, True, 0)
 
-        info_field = InfoField(self._service.Harvest.TIMESTAMP)
+        info_field = InfoField(self._service.Harvest.TIMESTAMP,
+                               self._settings)
         collect_form.pack_start(info_field, True, False, 0)
 
         for c in container.get_children():
@@ -103,9 +107,10 @@ class WebService(WebService):
 
 class InfoField(Gtk.Label):
 
-    def __init__(self, path):
+    def __init__(self, path, settings):
         Gtk.Label.__init__(self, '')
         self._path = path
+        self._settings = settings
 
         self.set_alignment(0, 0)
         self.set_line_wrap(True)
@@ -115,15 +120,13 @@ class InfoField(Gtk.Label):
         self._set_notifier()
 
     def _set_notifier(self):
-        client = GConf.Client.get_default()
-        self._notify = client.notify_add(self._path, self.__set_label_cb, None)
+        self._settings.notify_add(self._path, self.__set_label_cb)
 
     def __set_label_cb(self, *args):
         self._set_label()
 
     def _set_label(self):
-        client = GConf.Client.get_default()
-        timestamp = client.get_int(self._path)
+        timestamp = self._settings.get_int(self._path)
         if timestamp:
             date = time.strftime("%D %H:%M", time.localtime(timestamp))
             self.set_text(_('Collected at %s.') % date)
@@ -150,22 +153,33 @@ class CollectButtonField(Gtk.HBox):
         self.button.connect('clicked', self.__collect_cb)
 
     def __collect_cb(self, button, data=None):
+        self.button.set_sensitive(False)
         self.label.set_text(_('Please wait...'))
-        GLib.idle_add(self.__do_collect_cb)
-
-    def __do_collect_cb(self):
-        try:
-            self._service.Harvest().collect(forced=True)
-        except self._service.MissingInfoError:
+        scheduler = self._service.get_scheduler()
+        scheduler.trigger(forced=True,
+                          done_cb=self.__collected_cb,
+                          progress_cb=self.__progress_cb)
+
+    def __progress_cb(self, stage):
+        if stage == self._service.Harvest.STAGE_COLLECTING:
+            self.label.set_text(_('Collecting...'))
+        elif stage == self._service.Harvest.STAGE_SENDING:
+            self.label.set_text(_('Sending...'))
+
+    def __collected_cb(self, error):
+        self.button.set_sensitive(True)
+        if isinstance(error, self._service.MissingInfoError):
             self.label.set_text(_('Missing server information.'))
-        except self._service.TooSoonError:
+        elif isinstance(error, self._service.TooSoonError):
             self.label.set_text(_('Too soon to collect again.'))
-        except self._service.NothingNewError:
+        elif isinstance(error, self._service.NothingNewError):
             self.label.set_text(_('Nothing new to collect.'))
-        except self._service.SendError:
+        elif isinstance(error, self._service.SendError):
             self.label.set_text(_('Could not be collected.'))
-        except self._service.NoCharacteristicsError:
+        elif isinstance(error, self._service.NoCharacteristicsError):
             self.label.set_text(_('Missing learners characteristics'))
+        elif error is not None:
+            self.label.set_text(_('Could not be collected.'))
         else:
             self.label.set_text(_('Successfully collected.'))
 
@@ -176,10 +190,11 @@ class ComboField(Gtk.HBox):
     TEXT = 0
     VALUE = 1
 
-    def __init__(self, label_text, options, path):
+    def __init__(self, label_text, options, path, settings):
         Gtk.HBox.__init__(self, spacing=style.DEFAULT_SPACING)
         self._options = options
         self._path = path
+        self._settings = settings
 
         self.label = Gtk.Label(label_text)
         self.label.modify_fg(Gtk.StateType.NORMAL,
@@ -196,13 +211,11 @@ class ComboField(Gtk.HBox):
         self.combo.connect('changed', self.__changed_cb)
 
     def __changed_cb(self, combo):
-        client = GConf.Client.get_default()
         index = combo.get_active()
-        client.set_int(self._path, self._options[index][self.VALUE])
+        self._settings.set_int(self._path, self._options[index][self.VALUE])
 
     def _restore_option(self):
-        client = GConf.Client.get_default()
-        value = client.get_int(self._path)
+        value = self._settings.get_int(self._path)
         for index, option in enumerate(self._options):
             if value == option[self.VALUE]:
                 self.combo.set_active(index)
@@ -211,7 +224,7 @@ class ComboField(Gtk.HBox):
 class AutoField(Gtk.HBox):
     __gtype_name__ = 'SugarAutoField'
 
-    def __init__(self, label_text, path):
+    def __init__(self, label_text, path, settings):
         Gtk.HBox.__init__(self, spacing=style.DEFAULT_SPACING)
 
         self.label = Gtk.Label(label_text)
@@ -220,7 +233,7 @@ class AutoField(Gtk.HBox):
         self.label.set_alignment(1, 0.5)
         self.pack_start(self.label, False, True, 0)
 
-        self.entry = AutoEntry(path)
+        self.entry = AutoEntry(path, settings)
         self.entry.set_max_length(50)
         self.entry.set_width_chars(50)
         self.pack_start(self.entry, False, True, 0)
@@ -232,28 +245,26 @@ class AutoEntry(Gtk.Entry):
     DELAY = 1
     EDITABLE = '/desktop/sugar/collaboration/harvest_editable'
 
-    def __init__(self, path):
+    def __init__(self, path, settings):
         Gtk.Entry.__init__(self)
         self._path = path
+        self._settings = settings
         self._timeout_id = None
         self._restore_text()
         self._set_editable()
         self.connect('key-press-event', self.__pressed_start_cb)
 
     def _set_editable(self):
-        client = GConf.Client.get_default()
-        if client.get_bool(self.EDITABLE) is False:
+        if self._settings.get_bool(self.EDITABLE) is False:
             self.props.editable = False
 
     def _restore_text(self):
-        client = GConf.Client.get_default()
-        text = client.get_string(self._path)
+        text = self._settings.get_string(self._path)
         if text is not None:
             self.set_text(text)
 
     def __save_text_cb(self):
-        client = GConf.Client.get_default()
-        client.set_string(self._path, self.get_text())
+        self._settings.set_string(self._path, self.get_text())
         self._timeout_id = None
         return False
 
@@ -36,13 +36,8 @@ class Account(account.Account):
         GLib.idle_add(self.__collect_cb)
 
     def __collect_cb(self):
-        harvest = accountsmanager.get_service('harvest').Harvest()
-        if harvest.is_not_enabled():
-            return
-        try:
-            harvest.collect()
-        except Exception:
-            pass
+        accountsmanager.get_service('harvest').get_scheduler().trigger()
+        return False
 
     def get_token_state(self):
         return self.STATE_VALID
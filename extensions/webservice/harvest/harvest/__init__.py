@@ -0,0 +1,27 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+from .harvest import Harvest
+from .errors import MissingInfoError
+from .errors import NotSelectedError
+from .errors import TooSoonError
+from .errors import NothingNewError
+from .errors import SendError
+from .errors import NoCharacteristicsError
+from .errors import CollectError
+from .errors import BusyError
+from .settings import get_settings
+from .scheduler import get_scheduler
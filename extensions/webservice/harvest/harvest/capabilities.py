@@ -0,0 +1,163 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+import time
+import random
+import email.utils
+
+
+class Capabilities(object):
+    """ what the server has advertised it accepts, remembered on disk
+
+    Along with the hostname it was learned from, see bind().
+    """
+
+    ENCODING_HEADER = 'Accept-Encoding'
+    VERSIONS_HEADER = 'x-harvest-versions'
+    BATCH_HEADER = 'x-harvest-batch'
+    CHUNKS_HEADER = 'x-harvest-chunks'
+    RETRY_AFTER_HEADER = 'Retry-After'
+    WINDOW_HEADER = 'x-harvest-window'
+    BUSY = [429, 503]
+    GZIP = 'gzip'
+
+    def __init__(self, path):
+        self._path = path
+        self._data = {}
+        self._load()
+
+    def learn(self, message):
+        """ update from the response headers of a completed message """
+        headers = message.response_headers
+        changed = False
+
+        encoding = headers.get_one(self.ENCODING_HEADER)
+        if encoding is not None:
+            self._data['gzip'] = self.GZIP in encoding
+            changed = True
+
+        versions = headers.get_one(self.VERSIONS_HEADER)
+        if versions is not None:
+            self._data['versions'] = _split(versions)
+            changed = True
+
+        batch = headers.get_one(self.BATCH_HEADER)
+        if batch is not None:
+            self._data['batch'] = batch.strip() != '0'
+            changed = True
+
+        chunks = headers.get_one(self.CHUNKS_HEADER)
+        if chunks is not None:
+            self._data['chunks'] = chunks.strip() != '0'
+            changed = True
+
+        window = _seconds(headers.get_one(self.WINDOW_HEADER))
+        if window is not None:
+            self._data['window'] = window
+            changed = True
+
+        if message.status_code in self.BUSY:
+            delay = _retry_after(headers.get_one(self.RETRY_AFTER_HEADER))
+            if delay is not None:
+                # spread the laptops that were turned away together
+                jitter = random.random() * (self.window() or 0)
+                self._data['not_before'] = int(time.time() + delay + jitter)
+                changed = True
+
+        if changed:
+            self._save()
+
+    def bind(self, hostname):
+        """ forget what was learned, if it was from another server """
+        if self._data.get('hostname') == hostname:
+            return
+        self._data = {'hostname': hostname}
+        self._save()
+
+    def window(self):
+        """ seconds over which the server wants retries spread, if any """
+        return self._data.get('window', None)
+
+    def not_before(self):
+        """ the time before which the server asked not to be contacted """
+        return self._data.get('not_before', 0)
+
+    def accepts_gzip(self):
+        return self._data.get('gzip', False)
+
+    def forget_gzip(self):
+        self._data['gzip'] = False
+        self._save()
+
+    def accepts_version(self, version):
+        return version in self._data.get('versions', [])
+
+    def accepts_batch(self):
+        """ True or False once known, None if it was never advertised """
+        return self._data.get('batch', None)
+
+    def forget_batch(self):
+        self._data['batch'] = False
+        self._save()
+
+    def accepts_chunks(self):
+        """ True or False once known, None if it was never advertised """
+        return self._data.get('chunks', None)
+
+    def forget_chunks(self):
+        self._data['chunks'] = False
+        self._save()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as file:
+                self._data = json.load(file)
+        except (IOError, ValueError):
+            self._data = {}
+
+    def _save(self):
+        with open(self._path, 'w') as file:
+            json.dump(self._data, file)
+
+
+def _seconds(value):
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return None
+
+
+def _retry_after(value):
+    """ Retry-After is either a delay in seconds or an HTTP date """
+    if value is None:
+        return None
+    seconds = _seconds(value)
+    if seconds is not None:
+        return seconds
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
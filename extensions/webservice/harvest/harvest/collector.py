@@ -0,0 +1,182 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import sys
+import json
+import resource
+import subprocess
+
+from .crop import Crop
+from .cursor import Cursor
+from .index import Index
+from .compression import Compressor
+from .errors import NothingNewError
+from .errors import NoCharacteristicsError
+from .errors import CollectError
+from .harvest_logger import get_logger
+from .stats import get_stats
+
+GROW = 'grow'
+COLLECT = 'collect'
+
+NICE = 10
+IONICE = ['ionice', '-c', '2', '-n', '7']
+MAX_MEMORY = 402653184
+MAX_CPU = 600
+BLOCK_SIZE = 65536
+
+EXIT_NOTHING_NEW = 3
+EXIT_NO_CHARACTERISTICS = 4
+
+
+def build(cursor, start, end, file, columnar=False, index=None,
+          changes_path=None):
+    """ grow the cursor up to end and write its compressed crop to file,
+        returns the crop version
+
+    With an index, only what the server does not have goes in the crop,
+    and the index changes it carries are saved to changes_path.
+    """
+    cursor.grow(end)
+    if cursor.empty():
+        get_logger().debug('nothing new has grown.')
+        raise NothingNewError()
+
+    stats = get_stats()
+    crop = Crop(start=start, end=end, columnar=columnar, index=index)
+
+    # do not collect it, if we already know it will be rejected
+    with stats.timing('characterizable'):
+        characterizable = crop.characterizable()
+    if not characterizable:
+        get_logger().debug('missing learner characteristics.')
+        raise NoCharacteristicsError()
+
+    with stats.timing('collect'):
+        crop.collect(cursor.activities())
+    if not crop.grown():
+        get_logger().debug('nothing new has grown.')
+        raise NothingNewError()
+
+    output = Compressor(file)
+    with stats.timing('serialize'):
+        crop.write(output)
+        output.close()
+    stats.count('serialized_bytes', output.size)
+    if index is not None:
+        # entries deleted from the journal leave the index with the crop
+        with stats.timing('prune'):
+            stats.count('pruned', index.prune(Crop().object_ids()))
+        _save_changes(changes_path, index.changes())
+        stats.count('changed', len(index.changes()))
+    return crop.version()
+
+
+def _save_changes(path, changes):
+    with open(path, 'w') as file:
+        json.dump(changes, file, separators=(',', ':'))
+
+
+def run(mode, cursor_path, start, end, file=None, columnar=False,
+        index_path=None, changes_path=None):
+    """ grow or collect in a short lived, lower priority child process
+
+    Only the compressed crop comes back, copied into file as it arrives,
+    so whatever the journal scan needed is returned to the system as soon
+    as the child exits. Returns the crop version when collecting.
+    """
+    command = [sys.executable, '-m', 'harvest.collector', mode,
+               cursor_path, str(start or 0), str(end), str(int(columnar)),
+               index_path or '', changes_path or '']
+    if _which(IONICE[0]):
+        command = IONICE + command
+
+    environment = dict(os.environ)
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [path] + filter(None, [environment.get('PYTHONPATH')]))
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               env=environment, close_fds=True)
+    version = None
+    if mode == COLLECT:
+        version = process.stdout.readline().strip()
+        for block in iter(lambda: process.stdout.read(BLOCK_SIZE), ''):
+            file.write(block)
+    process.stdout.close()
+    process.wait()
+
+    if process.returncode == EXIT_NOTHING_NEW:
+        raise NothingNewError()
+    if process.returncode == EXIT_NO_CHARACTERISTICS:
+        raise NoCharacteristicsError()
+    if process.returncode != 0:
+        get_logger().error('collector failed with %d.' % process.returncode)
+        raise CollectError()
+    return version
+
+
+def _which(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(directory, name), os.X_OK):
+            return True
+    return False
+
+
+def _limit():
+    os.nice(NICE)
+    resource.setrlimit(resource.RLIMIT_AS, (MAX_MEMORY, MAX_MEMORY))
+    resource.setrlimit(resource.RLIMIT_CPU, (MAX_CPU, MAX_CPU))
+
+
+def main():
+    mode, cursor_path, start, end, columnar, index_path, changes_path = \
+        sys.argv[1:]
+    start = int(start) or None
+    end = int(end)
+    _limit()
+    index = None
+    if index_path:
+        index = Index(index_path)
+
+    # the parent keeps its own record, this one only goes to the log
+    stats = get_stats()
+    cursor = Cursor(cursor_path, start)
+    if mode == GROW:
+        cursor.grow(end)
+        stats.end('child grew')
+        return 0
+
+    # the version goes first, the parent streams the rest into the outbox
+    columnar = columnar == '1'
+    crop = Crop(columnar=columnar, index=index)
+    sys.stdout.write(crop.version() + '\n')
+    try:
+        build(cursor, start, end, sys.stdout, columnar, index, changes_path)
+    except NothingNewError:
+        stats.end('child NothingNewError')
+        return EXIT_NOTHING_NEW
+    except NoCharacteristicsError:
+        stats.end('child NoCharacteristicsError')
+        return EXIT_NO_CHARACTERISTICS
+    stats.end('child collected')
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import zlib
+
+LEVEL = 6
+WBITS = zlib.MAX_WBITS | 16
+MAGIC = '\x1f\x8b'
+
+
+def compress(data):
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data):
+    return zlib.decompress(data, WBITS)
+
+
+def decompressor():
+    return zlib.decompressobj(WBITS)
+
+
+def compressed(data):
+    """ compress data, unless it was stored compressed already """
+    if data.startswith(MAGIC):
+        return data
+    return compress(data)
+
+
+class Compressor(object):
+    """ gzip whatever is written into another file-like object """
+
+    def __init__(self, file):
+        self._file = file
+        self._compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS)
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self._file.write(self._compressor.compress(data))
+
+    def close(self):
+        self._file.write(self._compressor.flush())
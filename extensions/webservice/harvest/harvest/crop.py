@@ -14,46 +14,124 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 
-import os
 import json
-import hashlib
+from array import array
+from cStringIO import StringIO
 
-from gi.repository import GConf
-
-from sugar3.datastore import datastore
+from .identity import get_identity
+from .journal import get_journal
+from .settings import get_settings
 
 
 class CropErrorNotReady:
     pass
 
 
+class Instance(object):
+    """ one journal entry, kept as compactly as possible
+
+    Launch times are kept as a machine array and the activity id and mime
+    type are shared with every other instance of the same ones. row() has
+    the fields in the order they are sent.
+    """
+
+    __slots__ = ['activity_id', 'object_id', 'filesize', 'creation_time',
+                 'timestamp', 'buddies', 'share_scope', 'title_set_by_user',
+                 'keep', 'mime_type', 'launches']
+
+    def __init__(self, activity_id, row):
+        self.activity_id = _intern(activity_id)
+        self.object_id = _ascii(row[0])
+        self.filesize = row[1]
+        self.creation_time = row[2]
+        self.timestamp = row[3]
+        self.buddies = row[4]
+        self.share_scope = row[6]
+        self.title_set_by_user = row[7]
+        self.keep = row[8]
+        self.mime_type = _intern(row[9])
+        self.launches = _array(row[10])
+
+    def row(self):
+        # the sixth field is always empty
+        return [self.object_id, self.filesize, self.creation_time,
+                self.timestamp, self.buddies, None, self.share_scope,
+                self.title_set_by_user, self.keep, self.mime_type,
+                list(self.launches)]
+
+
 class Crop(object):
 
     VERSION = '000312'
+    COLUMNAR_VERSION = '000400'
+    DELTA_VERSION = '000320'
+    COLUMNAR_DELTA_VERSION = '000420'
+    VERSIONS = [VERSION, COLUMNAR_VERSION, DELTA_VERSION,
+                COLUMNAR_DELTA_VERSION]
 
-    ARM_SN_PATH = '/ofw/serial-number/serial-number'
-    X86_SN_PATH = '/proc/device-tree/serial-number'
     AGE_PATH = '/desktop/sugar/user/birth_timestamp'
     GENDER_PATH = '/desktop/sugar/user/gender'
-    BUILD_PATH = '/boot/olpc_build'
-    UPDATED_PATH = '/var/lib/misc/last_os_update.stamp'
-
-    def __init__(self, start=None, end=None):
+    PAGE_SIZE = 100
+    SORTING = ['+timestamp']
+    PROPERTIES = ['uid', 'activity', 'filesize', 'creation_time',
+                  'timestamp', 'buddies', 'share-scope', 'title_set_by_user',
+                  'keep', 'mime_type', 'launch-times']
+    ID_PROPERTIES = ['uid', 'timestamp']
+
+    # instance fields kept as columns, the sixth one is always empty
+    COLUMNS = [0, 1, 2, 3, 4, 6, 7, 8, 9, 10]
+    # but deltas use it for the launch times left out
+    DELTA_COLUMNS = range(11)
+    OFFSET = 5
+    MIME_TYPE = 9
+    LAUNCHES = 10
+
+    def __init__(self, start=None, end=None, columnar=False, index=None):
+        """ with an Index, only what the server does not have is sent """
         self._start = start
         self._end = end
+        self._columnar = columnar
+        self._index = index
+        self._offsets = {}
+        self._grown = False
         self._data = None
 
+    def version(self):
+        if self._columnar:
+            if self._index is not None:
+                return self.COLUMNAR_DELTA_VERSION
+            return self.COLUMNAR_VERSION
+        if self._index is not None:
+            return self.DELTA_VERSION
+        return self.VERSION
+
     def serialize(self):
         if not self._data:
             raise CropErrorNotReady()
-        return json.dumps(self._data)
+        output = StringIO()
+        self.write(output)
+        return output.getvalue()
+
+    def write(self, file):
+        """ serialize into file, a few instances at a time
+
+        Neither the whole text nor the columns of every activity are ever
+        held in memory.
+        """
+        if not self._data:
+            raise CropErrorNotReady()
+        laptop, learner, activities = self._data
+        file.write('[%s,%s,' % (_encode(laptop), _encode(learner)))
+        if self._columnar:
+            self._write_columns(file, activities)
+        else:
+            self._write_activities(file, activities)
+        file.write(']')
 
     def grown(self):
         if not self._data:
             raise CropErrorNotReady()
-        if not self._data[2].keys():
-            return False
-        return True
+        return self._grown
 
     def characterizable(self):
         """ check if all learner characteristics are available """
@@ -63,11 +141,33 @@ class Crop(object):
             return False
         return True
 
-    def collect(self):
+    def collect(self, activities=None):
+        """ collect the crop, optionally from already gathered activities """
         self._data = []
         self._data.append(self._laptop())
         self._data.append(self._learner())
-        self._data.append(self._activities())
+        if activities is None:
+            activities = self._activities()
+        if self._index is not None:
+            activities = self._deltas(activities)
+        self._grown = bool(activities)
+        self._data.append(activities)
+
+    def sprouted(self):
+        """ cheaply check if any entry changed within the window """
+        entries, count = get_journal().find(self._query(), limit=1,
+                                            properties=['uid'])
+        return count > 0
+
+    def instances(self):
+        """ iterate over the Instance of every entry within the window """
+        for entry in self._entries():
+            yield self._instance(entry)
+
+    def object_ids(self):
+        """ iterate over the object id of every entry within the window """
+        for entry in self._entries(self.ID_PROPERTIES):
+            yield entry.get_object_id()
 
     def _laptop(self):
         laptop = []
@@ -78,26 +178,13 @@ class Crop(object):
         return laptop
 
     def _serial_number(self):
-        path = None
-        if os.path.exists(self.ARM_SN_PATH):
-            path = self.ARM_SN_PATH
-        elif os.path.exists(self.X86_SN_PATH):
-            path = self.X86_SN_PATH
-        if path is not None:
-            with open(path, 'r') as file:
-                return hashlib.sha1(file.read().rstrip('\0\n')).hexdigest()
-        return None
+        return get_identity().serial_number()
 
     def _build(self):
-        if os.path.exists(self.BUILD_PATH):
-            with open(self.BUILD_PATH, 'r') as file:
-                return file.read().rstrip('\0\n')
-        return None
+        return get_identity().build()
 
     def _updated(self):
-        if os.path.exists(self.UPDATED_PATH):
-            return int(os.stat(self.UPDATED_PATH).st_mtime)
-        return None
+        return get_identity().updated()
 
     def _collected(self):
         return self._end
@@ -109,61 +196,168 @@ class Crop(object):
         return learner
 
     def _age(self):
-        client = GConf.Client.get_default()
-        age = client.get_int(self.AGE_PATH)
+        age = get_settings().get_int(self.AGE_PATH)
         if not age:
             return None
         return age
 
     def _gender(self):
-        client = GConf.Client.get_default()
-        return client.get_string(self.GENDER_PATH)
+        return get_settings().get_string(self.GENDER_PATH)
 
     def _activities(self):
         activities = {}
-        entries, count = datastore.find(self._query())
-        for entry in entries:
-            activity_id = entry.metadata.get('activity', '')
-            if activity_id not in activities:
-                activities[activity_id] = []
-            activities[activity_id].append(self._instance(entry))
+        for instance in self.instances():
+            if instance.activity_id not in activities:
+                activities[instance.activity_id] = []
+            activities[instance.activity_id].append(instance)
         return activities
 
-    def _query(self):
+    def _deltas(self, activities):
+        """ leave out what the server already has
+
+        Instances it has as they are are left out whole. Otherwise, the
+        sixth field is the number of launch times it already has, which
+        are left out of the last field.
+        """
+        deltas = {}
+        for activity_id, instances in activities.iteritems():
+            changed = []
+            for instance in instances:
+                offset = self._index.offset(instance)
+                if offset is None:
+                    continue
+                if offset:
+                    self._offsets[instance.object_id] = offset
+                changed.append(instance)
+            if changed:
+                deltas[activity_id] = changed
+        return deltas
+
+    def _row(self, instance):
+        row = instance.row()
+        offset = self._offsets.get(instance.object_id)
+        if offset:
+            row[self.OFFSET] = offset
+            row[self.LAUNCHES] = row[self.LAUNCHES][offset:]
+        return row
+
+    def _strings(self, activities):
+        """ the table of activity ids and mime types, and their indexes """
+        strings = []
+        indexes = {None: None}
+        for activity_id, instances in activities.iteritems():
+            for value in [activity_id] + \
+                    [instance.mime_type for instance in instances]:
+                if value not in indexes:
+                    indexes[value] = len(strings)
+                    strings.append(value)
+        return strings, indexes
+
+    def _column(self, rows, field, indexes):
+        if field == self.MIME_TYPE:
+            return [indexes[row[field]] for row in rows]
+        return [row[field] for row in rows]
+
+    def _write_activities(self, file, activities):
+        file.write('{')
+        for number, (activity_id, instances) in \
+                enumerate(activities.iteritems()):
+            if number:
+                file.write(',')
+            file.write('%s:[' % _encode(activity_id))
+            for offset in xrange(0, len(instances), self.PAGE_SIZE):
+                if offset:
+                    file.write(',')
+                file.write(','.join(
+                    _encode(self._row(instance))
+                    for instance in instances[offset:offset +
+                                              self.PAGE_SIZE]))
+            file.write(']')
+        file.write('}')
+
+    def _write_columns(self, file, activities):
+        """ per-field arrays for each activity, sharing one string table
+
+        Activity ids and mime types are replaced by their index in the
+        table, so the third crop element becomes [strings, activities],
+        where every activity is [activity, object_ids, filesizes,
+        creation_times, timestamps, buddies, shares, titles, keeps,
+        mime_types, launches]. Deltas keep the offsets column too, right
+        after buddies.
+        """
+        strings, indexes = self._strings(activities)
+        file.write('[%s,[' % _encode(strings))
+        for number, (activity_id, instances) in \
+                enumerate(activities.iteritems()):
+            if number:
+                file.write(',')
+            file.write('[%s' % _encode(indexes[activity_id]))
+            rows = [self._row(instance) for instance in instances]
+            columns = self.COLUMNS
+            if self._index is not None:
+                columns = self.DELTA_COLUMNS
+            for field in columns:
+                file.write(',')
+                file.write(_encode(self._column(rows, field, indexes)))
+            file.write(']')
+        file.write(']]')
+
+    def _entries(self, properties=None):
+        """ iterate over matching entries, one page at a time
+
+        Pages start from the last timestamp seen rather than from an
+        offset, so an entry saved during the scan, which moves past the
+        window, does not shift the later ones out of the next page. Those
+        seen at that timestamp come again and are left out, and only a
+        page that is all the same timestamp moves on by offset.
+        """
+        if properties is None:
+            properties = self.PROPERTIES
+        start = self._start
+        seen = set()
+        offset = 0
+        while True:
+            entries, count = get_journal().find(self._query(start),
+                                                sorting=self.SORTING,
+                                                limit=self.PAGE_SIZE,
+                                                offset=offset,
+                                                properties=properties)
+            moved = False
+            for entry in entries:
+                object_id = entry.get_object_id()
+                if object_id in seen:
+                    continue
+                timestamp = _timestamp(entry.metadata.get('timestamp'))
+                if timestamp is not None and timestamp != start:
+                    start = timestamp
+                    seen = set()
+                    moved = True
+                seen.add(object_id)
+                yield entry
+            if not entries or offset + len(entries) >= count:
+                break
+            if moved:
+                offset = 0
+            else:
+                offset += len(entries)
+
+    def _query(self, start=None):
         query = {}
         query['timestamp'] = {}
-        if self._start:
-            query['timestamp']['start'] = self._start
+        if start is None:
+            start = self._start
+        if start:
+            query['timestamp']['start'] = start
         if self._end:
             query['timestamp']['end'] = self._end
         return query
 
     def _instance(self, entry):
-        instance = []
-        instance.append(entry.get_object_id())
-        instance.append(_int(entry.metadata.get('filesize', None)))
-        instance.append(_int(entry.metadata.get('creation_time', None)))
-        instance.append(_int(entry.metadata.get('timestamp', None)))
-        instance.append(self._buddies(entry))
-        instance.append(None)
-        instance.append(_bool(entry.metadata.get('share-scope', None)))
-        instance.append(_bool(entry.metadata.get('title_set_by_user', None)))
-        instance.append(_bool(entry.metadata.get('keep', None)))
-        instance.append(_str(entry.metadata.get('mime_type', None)))
-        instance.append(self._launches(entry))
-        return instance
-
-    def _buddies(self, entry):
-        buddies = entry.metadata.get('buddies', None)
-        if not buddies:
-            return None
-        return len(json.loads(buddies).values())
-
-    def _launches(self, entry):
-        launch_times = entry.metadata.get('launch-times', None)
-        if not launch_times:
-            return []
-        return map(_int, launch_times.split(', '))
+        get = entry.metadata.get
+        row = [convert(get(key)) if key is not None else convert
+               for key, convert in _FIELDS]
+        row.insert(0, entry.get_object_id())
+        return Instance(get('activity', ''), row)
 
 
 def _bool(value):
@@ -180,7 +374,85 @@ def _int(value):
     return int(value)
 
 
+def _timestamp(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
 def _str(value):
     if not value:
         return None
     return str(value)
+
+
+def _buddies(value):
+    """ count buddies, entries shared within a group repeat the same blob """
+    if not value:
+        return None
+    # looked up once, another thread may clear it in between
+    count = _buddies_counts.get(value)
+    if count is None:
+        if len(_buddies_counts) >= _CACHE_SIZE:
+            _buddies_counts.clear()
+        count = _buddies_counts[value] = len(json.loads(value))
+    return count
+
+
+def _launches(value):
+    if not value:
+        return []
+    try:
+        # parse every launch time at once, as a json list
+        return json.loads('[%s]' % value)
+    except ValueError:
+        return map(_int, value.split(', '))
+
+
+def _intern(value):
+    """ one shared copy of the strings that repeat across instances """
+    if value is None:
+        return None
+    value = _ascii(value)
+    if not isinstance(value, str):
+        return value
+    return intern(value)
+
+
+def _ascii(value):
+    # a plain string takes a fraction of the memory of a unicode one
+    try:
+        return str(value)
+    except UnicodeEncodeError:
+        return value
+
+
+def _array(values):
+    try:
+        return array('l', values)
+    except (TypeError, OverflowError):
+        # keep whatever can not be a machine integer as it is
+        return tuple(values)
+
+
+_CACHE_SIZE = 1024
+
+# buddy count of every blob seen lately
+_buddies_counts = {}
+
+# one encoder for every call, json.dumps would build one each time
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+# metadata key and conversion of every instance field after the object id,
+# or no key and the value itself for the fields that are always the same
+_FIELDS = [('filesize', _int),
+           ('creation_time', _int),
+           ('timestamp', _int),
+           ('buddies', _buddies),
+           (None, None),
+           ('share-scope', _bool),
+           ('title_set_by_user', _bool),
+           ('keep', _bool),
+           ('mime_type', _str),
+           ('launch-times', _launches)]
@@ -0,0 +1,209 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+
+from .crop import Crop
+from .crop import Instance
+from .harvest_logger import get_logger
+from .stats import get_stats
+
+
+class Cursor(object):
+    """ journal instances gathered incrementally since the last harvest
+
+    The cursor itself is small and read on every trigger. The gathered
+    instances are kept apart, in a log every trigger only appends its
+    changes to, one instance per line with the last line of an instance
+    winning. The log is only read, and compacted, once the crop is built.
+    """
+
+    TEMPORARY = '.tmp'
+    INSTANCES = '.instances'
+    FORMAT = 2
+    BLOCK_SIZE = 65536
+
+    def __init__(self, path, start):
+        self._path = path
+        self._instances_path = path + self.INSTANCES
+        self._start = start
+        self._timestamp = None
+        self._count = 0
+        self._valid = False
+        self._instances = None
+        self._logger = get_logger()
+        self._load()
+
+    def grow(self, end):
+        """ append the journal changes since the last processed timestamp """
+        stats = get_stats()
+        count = 0
+        if not self._valid:
+            # whatever was logged belongs to another window
+            self._truncate()
+        with stats.timing('sprouted'):
+            sprouted = Crop(start=self._since(), end=end).sprouted()
+        if sprouted:
+            crop = Crop(start=self._since(), end=end)
+            with stats.timing('query'):
+                with self._log() as file:
+                    for instance in crop.instances():
+                        # a re-modified entry is logged again, and wins
+                        file.write(_line(instance))
+                        count += 1
+            self._count += count
+            self._instances = None
+        self._timestamp = end
+        self._save()
+        stats.count('entries', count)
+        stats.count('instances', self._count)
+        self._logger.debug('cursor grew %d instances.' % count)
+
+    def empty(self):
+        return self._count == 0
+
+    def activities(self):
+        """ group the gathered instances by activity, as Crop expects """
+        activities = {}
+        for instance in self._get_instances().itervalues():
+            if instance.activity_id not in activities:
+                activities[instance.activity_id] = []
+            activities[instance.activity_id].append(instance)
+        return activities
+
+    def reset(self, start):
+        """ start over from a new harvest window """
+        self._start = start
+        self._timestamp = None
+        self._instances = {}
+        self._truncate()
+        self._save()
+
+    def _since(self):
+        return self._timestamp or self._start
+
+    def _get_instances(self):
+        if self._instances is None:
+            with get_stats().timing('load'):
+                self._instances = self._load_instances()
+            if self._instances is None:
+                # start over, so that nothing gathered since then is missed
+                self._logger.debug('discarded unreadable cursor instances.')
+                self._instances = self._gather()
+            if self._count != len(self._instances):
+                with get_stats().timing('save'):
+                    self._compact()
+        return self._instances
+
+    def _gather(self):
+        instances = {}
+        for instance in Crop(start=self._start,
+                             end=self._timestamp).instances():
+            instances[instance.object_id] = instance
+        return instances
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as file:
+                data = json.load(file)
+        except (IOError, ValueError):
+            self._logger.debug('discarded unreadable cursor.')
+            return
+        # don't use it if it belongs to another version or window
+        if data.get('version') != Crop.VERSION or \
+           data.get('format') != self.FORMAT or \
+           data.get('start') != self._start:
+            self._logger.debug('discarded stale cursor.')
+            return
+        self._timestamp = data.get('timestamp')
+        self._count = data.get('count', 0)
+        self._valid = True
+
+    def _load_instances(self):
+        """ the last logged row of every instance, None if unreadable """
+        instances = {}
+        if not self._valid or not os.path.exists(self._instances_path):
+            return instances
+        try:
+            with open(self._instances_path, 'r') as file:
+                for line in file:
+                    activity_id, row = json.loads(line)
+                    instance = Instance(activity_id, row)
+                    instances[instance.object_id] = instance
+        except (IOError, ValueError, TypeError):
+            return None
+        return instances
+
+    def _save(self):
+        data = {}
+        data['version'] = Crop.VERSION
+        data['format'] = self.FORMAT
+        data['start'] = self._start
+        data['timestamp'] = self._timestamp
+        data['count'] = self._count
+        _write(self._path, data)
+        self._valid = True
+
+    def _log(self):
+        """ the log, open for appending after its last whole line """
+        file = open(self._instances_path, 'a+b')
+        file.seek(0, 2)
+        size = end = file.tell()
+        # an interrupted append leaves a partial line behind, the grow it
+        # belongs to was never saved and gathers it again
+        while end > 0:
+            start = max(0, end - self.BLOCK_SIZE)
+            file.seek(start)
+            newline = file.read(end - start).rfind('\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            file.truncate(end)
+        return file
+
+    def _truncate(self):
+        self._count = 0
+        with open(self._instances_path, 'w'):
+            pass
+
+    def _compact(self):
+        """ rewrite the log with only the last row of every instance """
+        temporary = self._instances_path + self.TEMPORARY
+        with open(temporary, 'w') as file:
+            for instance in self._instances.itervalues():
+                file.write(_line(instance))
+        os.rename(temporary, self._instances_path)
+        self._count = len(self._instances)
+        self._save()
+
+
+def _write(path, data):
+    temporary = path + Cursor.TEMPORARY
+    with open(temporary, 'w') as file:
+        json.dump(data, file)
+    os.rename(temporary, path)
+
+
+def _line(instance):
+    return '%s\n' % _encode([instance.activity_id, instance.row()])
+
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
@@ -37,3 +37,11 @@ class SendError(Exception):
 
 class NoCharacteristicsError(Exception):
     pass
+
+
+class CollectError(Exception):
+    pass
+
+
+class BusyError(Exception):
+    pass
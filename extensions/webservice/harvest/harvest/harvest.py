@@ -15,21 +15,42 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 
 import os
+import json
 import time
+import errno
+import fcntl
 import random
 import urlparse
+import contextlib
 
-from gi.repository import GConf
 from gi.repository import Soup
 
 from .crop import Crop
+from .cursor import Cursor
+from .collector import build
+from .collector import run
+from .collector import GROW
+from .collector import COLLECT
+from .compression import compress
+from .compression import compressed
+from .compression import decompress
+from .capabilities import Capabilities
+from .outbox import Outbox
+from .index import Index
 from .errors import MissingInfoError
 from .errors import NotSelectedError
 from .errors import TooSoonError
 from .errors import NothingNewError
 from .errors import SendError
 from .errors import NoCharacteristicsError
+from .errors import BusyError
 from .harvest_logger import get_logger
+from .settings import get_settings
+from .stats import get_stats
+from .uploader import FileBody
+from .uploader import get_uploader
+from .worker import Worker
+from .worker import call_in_main
 
 
 class Harvest(object):
@@ -41,134 +62,475 @@ class Harvest(object):
     SKIPS = 3
 
     ENDPOINT = '/rpc/store'
+    BATCH_ENDPOINT = '/rpc/store/batch'
+    BATCH_SIZE = 16
+    CHUNKS_ENDPOINT = '/rpc/store/chunk'
+    CHUNK_SIZE = 131072
+    UPLOAD_HEADER = 'x-harvest-upload'
+    OFFSET_HEADER = 'x-harvest-offset'
+    SIZE_HEADER = 'x-harvest-size'
+    ENCODING_HEADER = 'x-harvest-encoding'
+    CHUNK_TYPE = 'application/octet-stream'
+    UNSUPPORTED = [404, 405, 501]
     NOT_ENABLED = '/desktop/sugar/collaboration/harvest_not_enabled'
     FREQUENCY = '/desktop/sugar/collaboration/harvest_frequency'
     TIMESTAMP = '/desktop/sugar/collaboration/harvest_timestamp'
     RETRY = '/desktop/sugar/collaboration/harvest_retry'
     HOSTNAME = '/desktop/sugar/collaboration/harvest_hostname'
     API_KEY = '/desktop/sugar/collaboration/harvest_api_key'
+    SANDBOX = '/desktop/sugar/collaboration/harvest_sandbox'
+    STATS = '/desktop/sugar/collaboration/harvest_stats'
     WORKING_PATH = '~/.harvest/'
     CROP_FILE = 'crop'
     VERSION_FILE = 'crop.version'
-
-    def __init__(self):
+    CURSOR_FILE = 'cursor'
+    OUTBOX_DIR = 'outbox'
+    SERVER_FILE = 'server'
+    INDEX_FILE = 'index'
+    LOCK_FILE = 'lock'
+    VERSION_HEADER = 'x-harvest-version'
+    GZIP = 'gzip'
+
+    STAGE_GROWING = 'growing'
+    STAGE_COLLECTING = 'collecting'
+    STAGE_SENDING = 'sending'
+
+    def __init__(self, sandbox=True):
+        """ sandbox=False ignores the setting, for what is a child already """
         path = os.path.expanduser(self.WORKING_PATH)
         if not os.path.exists(path):
             os.makedirs(path, 0755)
 
         self._crop_path = os.path.join(path, self.CROP_FILE)
         self._version_path = os.path.join(path, self.VERSION_FILE)
+        self._cursor_path = os.path.join(path, self.CURSOR_FILE)
+        self._index_path = os.path.join(path, self.INDEX_FILE)
+        self._lock_path = os.path.join(path, self.LOCK_FILE)
+        self._capabilities = Capabilities(os.path.join(path,
+                                                       self.SERVER_FILE))
+        self._cursor = None
+        self._index = None
+        self._allow_sandbox = sandbox
+        self._progress_cb = None
         self._logger = get_logger()
-
-        client = GConf.Client.get_default()
-        self._not_enabled = client.get_bool(self.NOT_ENABLED)
-        self._frequency = client.get_int(self.FREQUENCY) or self.WEEKLY
-        self._timestamp = client.get_int(self.TIMESTAMP)
-        self._retry_timestamp = client.get_int(self.RETRY)
-        self._hostname = client.get_string(self.HOSTNAME)
-        self._api_key = client.get_string(self.API_KEY)
+        self._outbox = Outbox(os.path.join(path, self.OUTBOX_DIR))
+
+        self._load_settings()
+        self._migrate_crop()
+
+    def _load_settings(self):
+        settings = get_settings()
+        self._not_enabled = settings.get_bool(self.NOT_ENABLED)
+        self._frequency = settings.get_int(self.FREQUENCY) or self.WEEKLY
+        self._timestamp = settings.get_int(self.TIMESTAMP)
+        self._retry_timestamp = settings.get_int(self.RETRY)
+        self._hostname = settings.get_string(self.HOSTNAME)
+        self._api_key = settings.get_string(self.API_KEY)
+        # an older server may not understand what this one did
+        self._capabilities.bind(self._hostname)
+        self._sandbox = self._allow_sandbox and \
+            settings.get_bool(self.SANDBOX)
+        self._keep_stats = settings.get_bool(self.STATS)
 
     def is_not_enabled(self):
+        self._not_enabled = get_settings().get_bool(self.NOT_ENABLED)
         if self._not_enabled is True:
             self._logger.debug('automatic collection is not enabled')
             return True
         return False
 
     def _save_time(self, path, timestamp):
-        client = GConf.Client.get_default()
-        client.set_int(path, timestamp)
+        # GConf is not thread safe, always write from the main loop
+        call_in_main(get_settings().set_int, path, int(timestamp))
+
+    def _progress(self, stage):
+        if self._progress_cb is not None:
+            self._progress_cb(stage)
 
     def _selected(self):
         """ randomly determines if it will collect or not """
         return (not random.randrange(0, self.SKIPS))
 
+    def _harvested(self):
+        """ the end of the last window, either sent or still queued """
+        end = self._outbox.last_end()
+        if end is None:
+            return self._timestamp
+        return max(self._timestamp, end)
+
     def _ready(self, timestamp):
-        return (timestamp > self._timestamp + self._frequency)
+        return (timestamp > self._harvested() + self._frequency)
 
     def _retry_ready(self, timestamp):
         return (timestamp >= self._retry_timestamp)
 
     def _retry_in(self, timestamp):
-        """ retry allowed between 45 and 75 minutes since timestamp """
-        return (timestamp + self.DELAY + (self.OFFSET * random.random()))
-
-    def _send(self, data):
-        uri = Soup.URI.new(urlparse.urljoin(self._hostname, self.ENDPOINT))
+        """ retry allowed between 45 and 75 minutes since timestamp,
+            or over the window the server asked for, and never before
+            the server said it will be ready again """
+        offset = self._capabilities.window() or self.OFFSET
+        retry = timestamp + self.DELAY + (offset * random.random())
+        return max(retry, self._capabilities.not_before())
+
+    def _server_ready(self, timestamp):
+        return (timestamp >= self._capabilities.not_before())
+
+    def _message(self, endpoint, data, version=None, encoding=None):
+        uri = Soup.URI.new(urlparse.urljoin(self._hostname, endpoint))
         message = Soup.Message(method='POST', uri=uri)
         message.request_headers.append('x-api-key', self._api_key)
-        message.set_request('application/json',
-                            Soup.MemoryUse.COPY,
-                            data, len(data))
-
-        session = Soup.SessionSync()
-        session.add_feature_by_type(Soup.ProxyResolverDefault)
-        session.send_message(message)
-
+        if version is not None:
+            message.request_headers.append(self.VERSION_HEADER, version)
+        if encoding is not None:
+            message.request_headers.append('Content-Encoding', encoding)
+        if data is not None:
+            message.set_request('application/json',
+                                Soup.MemoryUse.COPY,
+                                data, len(data))
+        return message
+
+    def _transfer(self, message):
+        """ send a message and learn from the answer, timing both """
+        stats = get_stats()
+        with stats.timing('http'):
+            get_uploader().send(message)
+        stats.count('requests')
+        if message.status_code != 200:
+            stats.count('failed_requests')
+        self._capabilities.learn(message)
+
+    def _sent(self, message):
         if message.status_code == 200:
             return True
         self._logger.debug('could not send data: %d', message.status_code)
         return False
 
-    def _retry_valid(self):
+    def _post(self, endpoint, data=None, version=None, path=None):
+        """ post data, or a compressed file, compressed if it is accepted """
+        if self._capabilities.accepts_gzip():
+            message = self._message(endpoint, None, version, self.GZIP)
+            self._attach(message, data, path, False)
+            self._transfer(message)
+            if message.status_code != 415:
+                return message
+            self._logger.debug('compressed crop was not accepted.')
+            self._capabilities.forget_gzip()
+
+        message = self._message(endpoint, None, version)
+        self._attach(message, data, path, True)
+        self._transfer(message)
+        return message
+
+    def _attach(self, message, data, path, plain):
+        if path is not None:
+            # stream it, so the crop is never held in memory whole
+            FileBody(message, path, plain)
+            return
+        if not plain:
+            data = compress(data)
+        message.set_request('application/json',
+                            Soup.MemoryUse.COPY,
+                            data, len(data))
+
+    def _send(self, record):
+        return self._sent(self._post(self.ENDPOINT, version=record.version,
+                                     path=record.path))
+
+    def _send_batch(self, crops):
+        """ send many (crop, version) pairs at once, None if unsupported """
+        items = []
+        for crop, version in crops:
+            items.append('{"version":%s,"crop":%s}' %
+                         (json.dumps(version), decompress(crop)))
+        # a server that never advertised them may fail them any way
+        advertised = self._capabilities.accepts_batch()
+        message = self._post(self.BATCH_ENDPOINT, '[%s]' % ','.join(items))
+        if message.status_code in self.UNSUPPORTED or \
+           (advertised is None and message.status_code != 200):
+            self._logger.debug('batches are not supported.')
+            self._capabilities.forget_batch()
+            return None
+        return self._sent(message)
+
+    def _chunkable(self, record):
+        # the pieces are of the stored gzip crop, the server must decode it
+        return record.size > self.CHUNK_SIZE and \
+            self._capabilities.accepts_gzip() and \
+            self._capabilities.accepts_chunks() is not False
+
+    def _send_chunks(self, record):
+        """ upload a large crop in pieces, resuming where it was left
+
+        Every piece is a slice of the stored gzip crop, posted as opaque
+        bytes along with the crop checksum, its total size, the offset of
+        the slice and the encoding of the crop once it is put together.
+        The server answers with the offset it has received up to, or with
+        a 409 and that offset when ours is not the one it expected.
+        Returns None if the server does not support it.
+        """
+        offset = self._outbox.offset(record)
+        with open(record.path, 'rb') as file:
+            while offset < record.size:
+                file.seek(offset)
+                chunk = file.read(self.CHUNK_SIZE)
+                message = self._message(self.CHUNKS_ENDPOINT, None,
+                                        record.version)
+                message.set_request(self.CHUNK_TYPE, Soup.MemoryUse.COPY,
+                                    chunk, len(chunk))
+                headers = message.request_headers
+                headers.append(self.UPLOAD_HEADER, record.checksum)
+                headers.append(self.OFFSET_HEADER, str(offset))
+                headers.append(self.SIZE_HEADER, str(record.size))
+                headers.append(self.ENCODING_HEADER, self.GZIP)
+                self._transfer(message)
+
+                if message.status_code in self.UNSUPPORTED:
+                    self._logger.debug('chunks are not supported.')
+                    self._capabilities.forget_chunks()
+                    return None
+                if message.status_code not in [200, 409]:
+                    return self._sent(message)
+
+                received = _int(message.response_headers.get_one(
+                    self.OFFSET_HEADER))
+                if received is None or received == offset:
+                    self._logger.debug('chunk at %d was not received.',
+                                       offset)
+                    return False
+                offset = received
+                self._outbox.save_offset(record, offset)
+        return True
+
+    def _migrate_crop(self):
+        """ move a crop left by older versions into the outbox """
         if not os.path.exists(self._crop_path):
-            return False
+            return
         # don't use it if not sure about the version
-        if not os.path.exists(self._version_path):
-            os.remove(self._crop_path)
-            return False
-        with open(self._version_path, 'r') as file:
-            version = file.read()
-        if version != Crop.VERSION:
-            os.remove(self._crop_path)
+        if os.path.exists(self._version_path):
+            timestamp = int(os.stat(self._crop_path).st_mtime)
+            with open(self._crop_path, 'rb') as file:
+                crop = compressed(file.read())
+            with open(self._version_path, 'r') as file:
+                version = file.read()
+            self._outbox.append(crop, version, self._timestamp, timestamp)
             os.remove(self._version_path)
-            return False
-        return True
-
-    def _save_crop(self, crop, timestamp):
-        with open(self._crop_path, 'w') as file:
-            file.write(crop)
-        with open(self._version_path, 'w') as file:
-            file.write(Crop.VERSION)
-        os.utime(self._crop_path, (timestamp, timestamp))
-        self._logger.debug('saved crop to %s.' % self._crop_path)
-
-    def _restore_crop(self):
-        timestamp = os.stat(self._crop_path).st_mtime
-        with open(self._crop_path, 'r') as file:
-            crop = file.read()
-        os.remove(self._version_path)
         os.remove(self._crop_path)
-        self._logger.debug('restored crop from %s.' % self._crop_path)
-        return crop, timestamp
 
-    def _do_collect(self, timestamp):
-        self._logger.debug('collecting crop.')
-        crop = Crop(start=self._timestamp, end=timestamp)
-
-        # do not collect it, if we already know it will be rejected
-        if not crop.characterizable():
-            self._logger.debug('missing learner characteristics.')
-            raise NoCharacteristicsError()
+    def _get_cursor(self):
+        if self._cursor is None:
+            self._cursor = Cursor(self._cursor_path, self._harvested())
+        return self._cursor
+
+    def _get_index(self):
+        if self._index is None:
+            with get_stats().timing('index'):
+                self._index = Index(self._index_path)
+        return self._index
+
+    def _formats(self):
+        """ whether to send columns and deltas, as the server accepts """
+        accepts = self._capabilities.accepts_version
+        if accepts(Crop.COLUMNAR_DELTA_VERSION):
+            return True, True
+        if accepts(Crop.DELTA_VERSION):
+            return False, True
+        return accepts(Crop.COLUMNAR_VERSION), False
+
+    def _grow(self, timestamp):
+        """ gather what changed in the journal since the last trigger """
+        if self._sandbox:
+            # the child works on the cursor file, don't keep a stale one
+            self._cursor = None
+            with get_stats().timing('sandbox'):
+                run(GROW, self._cursor_path, self._harvested(), timestamp)
+        else:
+            self._get_cursor().grow(timestamp)
 
-        crop.collect()
-        if not crop.grown():
-            self._logger.debug('nothing new has grown.')
-            raise NothingNewError()
-        return crop.serialize()
+    def _do_collect(self, timestamp, writer):
+        self._logger.debug('collecting crop.')
+        self._progress(self.STAGE_COLLECTING)
+        columnar, delta = self._formats()
+        if self._sandbox:
+            self._cursor = None
+            index_path = None
+            if delta:
+                index_path = self._index_path
+            with get_stats().timing('sandbox'):
+                return run(COLLECT, self._cursor_path, self._harvested(),
+                           timestamp, writer, columnar,
+                           index_path, writer.changes_path)
+        index = None
+        if delta:
+            index = self._get_index()
+        return build(self._get_cursor(), self._harvested(), timestamp,
+                     writer, columnar, index, writer.changes_path)
+
+    def _harvest(self, timestamp):
+        """ queue a crop for the window since the last harvest """
+        # the crop goes straight into the outbox as it is serialized
+        writer = self._outbox.writer(self._harvested(), timestamp)
+        try:
+            version = self._do_collect(timestamp, writer)
+        except (NothingNewError, NoCharacteristicsError):
+            writer.discard()
+            # still worth sending what was queued before
+            if self._outbox.empty():
+                raise
+            return
+        except Exception:
+            writer.discard()
+            raise
+        with get_stats().timing('queue'):
+            writer.commit(version)
+        get_stats().count('payload_bytes', writer.size)
+        self._get_cursor().reset(timestamp)
+
+    def _drain(self):
+        """ send the queued crops in order, stop at the first failure """
+        try:
+            self._drain_records(self._outbox.records())
+        finally:
+            # once for every crop delivered, rather than after each one
+            if self._index is not None:
+                self._index.save()
+
+    def _drain_records(self, records):
+        while records:
+            if self._chunkable(records[0]):
+                record = records.pop(0)
+                if not self._outbox.verify(record):
+                    continue
+                sent = self._send_chunks(record)
+                if sent is False:
+                    raise SendError()
+                if sent is True:
+                    self._delivered(record)
+                    continue
+                records.insert(0, record)
+
+            batch = []
+            for record in records[:self.BATCH_SIZE]:
+                # larger crops are streamed rather than held in memory
+                if record.size > self.CHUNK_SIZE:
+                    break
+                batch.append(record)
+            if len(batch) > 1 and \
+               self._capabilities.accepts_batch() is not False:
+                if self._drain_batch(batch):
+                    records = records[len(batch):]
+                    continue
+
+            record = records.pop(0)
+            if not self._outbox.verify(record):
+                continue
+            if not self._send(record):
+                raise SendError()
+            self._delivered(record)
+
+    def _drain_batch(self, records):
+        """ send records in one request, False if the server lacks it """
+        crops = []
+        readable = []
+        for record in records:
+            crop = self._outbox.read(record)
+            if crop is not None:
+                crops.append((crop, record.version))
+                readable.append(record)
+        if not crops:
+            return True
 
-    def collect(self, forced=False):
-        self._logger.debug('triggered.')
+        sent = self._send_batch(crops)
+        if sent is None:
+            return False
+        if not sent:
+            raise SendError()
+        for record in readable:
+            self._delivered(record)
+        return True
 
+    def _delivered(self, record):
+        # the server has what the crop carried from now on
+        changes = self._outbox.changes(record)
+        if changes:
+            self._get_index().update(changes)
+        self._outbox.remove(record)
+        self._timestamp = max(self._timestamp, record.end)
+        self._save_time(self.TIMESTAMP, self._timestamp)
+
+    def collect_async(self, done_cb, forced=False, progress_cb=None):
+        """ collect in a worker thread, done_cb receives the error or None """
+        worker = Worker(lambda progress: self.collect(forced, progress),
+                        done_cb, progress_cb)
+        worker.start()
+
+    def collect(self, forced=False, progress_cb=None, send=True):
+        """ harvest and send, or only queue the crop if not send """
+        self._run(self._collect, 'collected', progress_cb, forced, send)
+
+    def send(self, progress_cb=None):
+        """ only send what was queued before """
+        self._run(self._send_queued, 'sent', progress_cb)
+
+    def _run(self, function, outcome, progress_cb, *args):
+        stats = get_stats()
+        stats.begin()
+        with stats.timing('settings'):
+            self._load_settings()
+        self._progress_cb = progress_cb
+        try:
+            with self._locked():
+                function(*args)
+        except Exception as error:
+            outcome = error.__class__.__name__
+            raise
+        finally:
+            # don't hold on to the gathered instances between collections
+            self._cursor = None
+            self._index = None
+            self._progress_cb = None
+            stats.end(outcome, self._keep_stats)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """ hold the working path, as another process may share it
+
+        A session and a pass over every profile may collect the same one
+        at once, whichever comes second gets a BusyError.
+        """
+        file = open(self._lock_path, 'a')
+        try:
+            try:
+                fcntl.lockf(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as error:
+                if error.errno not in [errno.EACCES, errno.EAGAIN]:
+                    raise
+                self._logger.debug('another collection is running.')
+                raise BusyError()
+            yield
+        finally:
+            # closing it releases the lock
+            file.close()
+
+    def _check_info(self):
         if not self._hostname or not self._api_key:
             self._logger.error('server information is missing')
             raise MissingInfoError()
 
+    def _collect(self, forced, send):
+        self._logger.debug('triggered.')
+        self._check_info()
+
+        # amortize the journal scan over every trigger
+        self._progress(self.STAGE_GROWING)
+        self._grow(int(time.time()))
+
         if not forced and not self._selected():
             self._logger.debug('skipped this time.')
             raise NotSelectedError()
 
         timestamp = int(time.time())
-        if not self._ready(timestamp):
+        ready = self._ready(timestamp)
+        if not ready and self._outbox.empty():
             self._logger.debug('it is too soon for collecting again.')
             raise TooSoonError()
 
@@ -177,13 +539,41 @@ class Harvest(object):
             raise TooSoonError()
         self._save_time(self.RETRY, self._retry_in(timestamp))
 
-        if self._retry_valid():
-            crop, timestamp = self._restore_crop()
-        else:
-            crop = self._do_collect(timestamp)
+        # crops still queued were turned away by earlier attempts
+        get_stats().count('retries', len(self._outbox.records()))
+        if ready:
+            self._harvest(timestamp)
+        if not send:
+            self._logger.info('successfully queued.')
+            return
+        self._upload(timestamp)
+
+    def _send_queued(self):
+        self._logger.debug('sending queued crops.')
+        self._check_info()
+        if self._outbox.empty():
+            raise NothingNewError()
+        self._upload(int(time.time()))
 
-        if not self._send(crop):
-            self._save_crop(crop, timestamp)
-            raise SendError()
-        self._save_time(self.TIMESTAMP, timestamp)
+    def _upload(self, timestamp):
+        # even forced collections honor the server backoff
+        if not self._server_ready(timestamp):
+            self._logger.debug('the server asked to wait.')
+            raise TooSoonError()
+
+        self._progress(self.STAGE_SENDING)
+        try:
+            self._drain()
+        finally:
+            # a busy server may have asked for a later retry
+            self._save_time(self.RETRY, self._retry_in(timestamp))
         self._logger.info('successfully collected.')
+
+
+def _int(value):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
@@ -0,0 +1,107 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+import hashlib
+
+
+_identity = None
+
+
+class Identity(object):
+    """ laptop identity, cached on disk until its source files change """
+
+    IDENTITY_FILE = '~/.harvest/identity'
+    ARM_SN_PATH = '/ofw/serial-number/serial-number'
+    X86_SN_PATH = '/proc/device-tree/serial-number'
+    BUILD_PATH = '/boot/olpc_build'
+    UPDATED_PATH = '/var/lib/misc/last_os_update.stamp'
+
+    def __init__(self):
+        self._path = os.path.expanduser(self.IDENTITY_FILE)
+        self._cache = {}
+        self._load()
+
+    def serial_number(self):
+        for path in [self.ARM_SN_PATH, self.X86_SN_PATH]:
+            stamp = _stamp(path)
+            if stamp is not None:
+                return self._cached('serial_number', path, stamp, _hash)
+        return None
+
+    def build(self):
+        stamp = _stamp(self.BUILD_PATH)
+        if stamp is None:
+            return None
+        return self._cached('build', self.BUILD_PATH, stamp, _read)
+
+    def updated(self):
+        stamp = _stamp(self.UPDATED_PATH)
+        if stamp is None:
+            return None
+        return stamp[0]
+
+    def _cached(self, name, path, stamp, compute):
+        entry = self._cache.get(name)
+        if entry is not None and entry['path'] == path and \
+           entry['stamp'] == stamp:
+            return entry['value']
+        value = compute(path)
+        self._cache[name] = {'path': path, 'stamp': stamp, 'value': value}
+        self._save()
+        return value
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as file:
+                self._cache = json.load(file)
+        except (IOError, ValueError):
+            self._cache = {}
+
+    def _save(self):
+        try:
+            with open(self._path, 'w') as file:
+                json.dump(self._cache, file)
+        except IOError:
+            pass
+
+
+def _stamp(path):
+    """ modification time and size of path, None if it does not exist """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [int(stat.st_mtime), stat.st_size]
+
+
+def _read(path):
+    with open(path, 'r') as file:
+        return file.read().rstrip('\0\n')
+
+
+def _hash(path):
+    return hashlib.sha1(_read(path)).hexdigest()
+
+
+def get_identity():
+    global _identity
+    if _identity is None:
+        _identity = Identity()
+    return _identity
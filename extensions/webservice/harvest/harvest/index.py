@@ -0,0 +1,113 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+import zlib
+
+
+class Index(object):
+    """ what the server already has of every journal entry
+
+    Every object id maps to a checksum of the instance fields, one of
+    its launch times and how many launch times there were. It is only
+    updated with what was delivered, see changes(), and only written
+    with save().
+    """
+
+    TEMPORARY = '.tmp'
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        self._changes = {}
+        self._updated = False
+        self._load()
+
+    def offset(self, instance):
+        """ how many launch times can be left out, None to leave it out """
+        row = instance.row()
+        launches = row[-1]
+        change = [_checksum(row[:-1]), _checksum(launches), len(launches)]
+        entry = self._entries.get(instance.object_id)
+        if entry == change:
+            return None
+        self._changes[instance.object_id] = change
+        if entry is None:
+            return 0
+        # only if the launch times sent before are still the first ones
+        count = entry[2]
+        if count > len(launches) or \
+           _checksum(launches[:count]) != entry[1]:
+            return 0
+        return count
+
+    def prune(self, object_ids):
+        """ forget the entries of every object id not in object_ids
+
+        The ids are only gone through when there is something to forget,
+        and returns how many there were.
+        """
+        if not self._entries:
+            return 0
+        gone = set(self._entries)
+        gone.difference_update(object_ids)
+        for object_id in gone:
+            self._changes[object_id] = None
+        return len(gone)
+
+    def changes(self):
+        """ the entries of the instances offset() did not leave out,
+            and None for those prune() forgot """
+        return self._changes
+
+    def update(self, changes):
+        for object_id, change in changes.iteritems():
+            if change is None:
+                self._entries.pop(object_id, None)
+            else:
+                self._entries[object_id] = change
+        self._updated = True
+
+    def save(self):
+        """ write what update() changed, if anything """
+        if not self._updated:
+            return
+        self._save()
+        self._updated = False
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as file:
+                self._entries = json.load(file)
+        except (IOError, ValueError):
+            # everything will be sent again, nothing is lost
+            self._entries = {}
+
+    def _save(self):
+        temporary = self._path + self.TEMPORARY
+        with open(temporary, 'w') as file:
+            json.dump(self._entries, file, separators=(',', ':'))
+        os.rename(temporary, self._path)
+
+
+def _checksum(values):
+    return zlib.crc32(_encode(values)) & 0xffffffff
+
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
@@ -0,0 +1,137 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import bisect
+
+from sugar3.datastore import datastore
+
+
+_journal = None
+
+
+class Metadata(object):
+    """ the metadata files of an entry, read as they are asked for """
+
+    def __init__(self, path, properties):
+        self._path = path
+        self._values = {}
+        for key in properties:
+            self._values[key] = self._read(key)
+
+    def get(self, key, default=None):
+        if key not in self._values:
+            self._values[key] = self._read(key)
+        value = self._values[key]
+        if value is None:
+            return default
+        return value
+
+    def _read(self, key):
+        if key is None:
+            return None
+        try:
+            with open(os.path.join(self._path, key), 'r') as file:
+                return file.read()
+        except IOError:
+            return None
+
+
+class Entry(object):
+
+    METADATA = 'metadata'
+
+    def __init__(self, object_id, path, properties):
+        self._object_id = object_id
+        self.metadata = Metadata(os.path.join(path, self.METADATA),
+                                 properties)
+
+    def get_object_id(self):
+        return self._object_id
+
+
+class DiskJournal(object):
+    """ the journal of a profile that is not running, read from disk
+
+    Entries live in datastore/<first two uid characters>/<uid>, with a
+    file per metadata key. Only the find() used by Crop is supported.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._window = None
+        self._matches = []
+
+    def find(self, query, sorting=None, limit=None, offset=None,
+             properties=None):
+        window = query.get('timestamp', {})
+        start, end = window.get('start'), window.get('end')
+        # pages narrow the same window from its start, one after the other
+        if self._window is None or self._window[1] != end or \
+           (start or 0) < (self._window[0] or 0):
+            self._window = (start, end)
+            self._matches = self._match(start, end)
+        first = 0
+        if start is not None:
+            first = bisect.bisect_left(self._matches, (start,))
+        offset = first + (offset or 0)
+        matches = self._matches[offset:]
+        if limit is not None:
+            matches = matches[:limit]
+        entries = [Entry(object_id, path, properties or [])
+                   for timestamp, object_id, path in matches]
+        return entries, len(self._matches) - first
+
+    def _match(self, start, end):
+        """ (timestamp, object_id, path) within the window, oldest first """
+        matches = []
+        for object_id, path in self._entries():
+            timestamp = Metadata(os.path.join(path, Entry.METADATA),
+                                 []).get('timestamp')
+            try:
+                timestamp = int(float(timestamp))
+            except (TypeError, ValueError):
+                continue
+            if (start is None or timestamp >= start) and \
+               (end is None or timestamp <= end):
+                matches.append((timestamp, object_id, path))
+        matches.sort()
+        return matches
+
+    def _entries(self):
+        if not os.path.isdir(self._path):
+            return
+        for prefix in os.listdir(self._path):
+            directory = os.path.join(self._path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for object_id in os.listdir(directory):
+                path = os.path.join(directory, object_id)
+                if os.path.isdir(os.path.join(path, Entry.METADATA)):
+                    yield object_id, path
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        _journal = datastore
+    return _journal
+
+
+def set_journal(journal):
+    """ use another journal than the session one, see DiskJournal """
+    global _journal
+    _journal = journal
@@ -0,0 +1,232 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+import hashlib
+
+from .harvest_logger import get_logger
+
+
+class Record(object):
+    """ one pending crop and the window it covers """
+
+    def __init__(self, name, path, meta):
+        self.name = name
+        self.path = path
+        self.version = meta['version']
+        self.start = meta['start']
+        self.end = meta['end']
+        self.checksum = meta['checksum']
+        self.size = meta['size']
+
+
+class Writer(object):
+    """ a compressed crop being queued, a record once committed """
+
+    def __init__(self, outbox, name, start, end):
+        self._outbox = outbox
+        self._name = name
+        self._start = start
+        self._end = end
+        self._checksum = hashlib.sha1()
+        self._path = outbox._file(name, Outbox.CROP)
+        self._file = open(self._path, 'wb')
+        self.size = 0
+        # where the index changes the crop carries go, see changes()
+        self.changes_path = outbox._file(name, Outbox.CHANGES)
+
+    def write(self, data):
+        self._file.write(data)
+        self._checksum.update(data)
+        self.size += len(data)
+
+    def commit(self, version):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        meta = {}
+        meta['version'] = version
+        meta['start'] = self._start
+        meta['end'] = self._end
+        meta['checksum'] = self._checksum.hexdigest()
+        meta['size'] = self.size
+        self._outbox._commit(self._name, meta)
+
+    def discard(self):
+        self._file.close()
+        for path in [self._path, self.changes_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Outbox(object):
+    """ pending crops, one record per harvested window, sent in order """
+
+    CROP = '.crop'
+    META = '.meta'
+    OFFSET = '.offset'
+    CHANGES = '.changes'
+    TEMPORARY = '.tmp'
+    MAX_SIZE = 4194304
+    BLOCK_SIZE = 65536
+
+    def __init__(self, path):
+        self._path = path
+        self._logger = get_logger()
+        if not os.path.exists(path):
+            os.makedirs(path, 0755)
+        self._clean()
+
+    def append(self, data, version, start, end):
+        """ durably queue a compressed crop """
+        writer = self.writer(start, end)
+        writer.write(data)
+        writer.commit(version)
+
+    def writer(self, start, end):
+        """ queue a compressed crop as it is written, see Writer """
+        return Writer(self, '%010d-%010d' % (end, start or 0), start, end)
+
+    def records(self):
+        """ the pending records, oldest window first """
+        records = []
+        for name in self._names():
+            try:
+                with open(self._file(name, self.META), 'r') as file:
+                    meta = json.load(file)
+                records.append(Record(name, self._file(name, self.CROP),
+                                      meta))
+            except (IOError, ValueError, KeyError):
+                self._logger.error('discarded unreadable crop %s.' % name)
+                self._remove(name)
+        return records
+
+    def empty(self):
+        return not self._names()
+
+    def last_end(self):
+        records = self.records()
+        if not records:
+            return None
+        return records[-1].end
+
+    def read(self, record):
+        """ the crop of a record, or None if it did not survive on disk """
+        try:
+            with open(record.path, 'rb') as file:
+                data = file.read()
+        except IOError:
+            data = None
+        if data is None or hashlib.sha1(data).hexdigest() != record.checksum:
+            self._logger.error('discarded corrupted crop %s.' % record.name)
+            self._remove(record.name)
+            return None
+        return data
+
+    def verify(self, record):
+        """ check a record without holding all of it in memory """
+        checksum = hashlib.sha1()
+        try:
+            with open(record.path, 'rb') as file:
+                for block in iter(lambda: file.read(self.BLOCK_SIZE), ''):
+                    checksum.update(block)
+        except IOError:
+            checksum = None
+        if checksum is None or checksum.hexdigest() != record.checksum:
+            self._logger.error('discarded corrupted crop %s.' % record.name)
+            self._remove(record.name)
+            return False
+        return True
+
+    def offset(self, record):
+        """ how much of a record the server has already received """
+        path = self._file(record.name, self.OFFSET)
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, 'r') as file:
+                return int(file.read())
+        except (IOError, ValueError):
+            return 0
+
+    def save_offset(self, record, offset):
+        path = self._file(record.name, self.OFFSET + self.TEMPORARY)
+        with open(path, 'w') as file:
+            file.write(str(offset))
+        os.rename(path, self._file(record.name, self.OFFSET))
+
+    def changes(self, record):
+        """ the index changes that hold once a record is delivered """
+        path = self._file(record.name, self.CHANGES)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            # without them, the instances will just be sent again
+            return {}
+
+    def remove(self, record):
+        self._remove(record.name)
+        self._logger.debug('removed crop %s.' % record.name)
+
+    def _commit(self, name, meta):
+        # the record only exists once its meta data is in place
+        path = self._file(name, self.META + self.TEMPORARY)
+        with open(path, 'w') as file:
+            json.dump(meta, file)
+        os.rename(path, self._file(name, self.META))
+        self._logger.debug('queued crop %s.' % name)
+        self._limit()
+
+    def _limit(self):
+        """ drop the oldest windows while over the disk usage cap """
+        records = self.records()
+        total = sum(record.size for record in records)
+        while total > self.MAX_SIZE and len(records) > 1:
+            record = records.pop(0)
+            self._remove(record.name)
+            total -= record.size
+            self._logger.error('dropped crop %s, outbox is full.' %
+                               record.name)
+
+    def _names(self):
+        return sorted(file[:-len(self.META)]
+                      for file in os.listdir(self._path)
+                      if file.endswith(self.META))
+
+    def _file(self, name, extension):
+        return os.path.join(self._path, name + extension)
+
+    def _remove(self, name):
+        # meta data goes first, so a half removed record is never used
+        for extension in [self.META, self.CROP, self.OFFSET, self.CHANGES]:
+            path = self._file(name, extension)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _clean(self):
+        """ remove leftovers of interrupted writes """
+        names = set(self._names())
+        for file in os.listdir(self._path):
+            name, extension = os.path.splitext(file)
+            if extension == self.TEMPORARY or \
+               (extension in [self.CROP, self.OFFSET, self.CHANGES] and
+                    name not in names):
+                os.remove(os.path.join(self._path, file))
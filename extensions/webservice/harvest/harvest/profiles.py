@@ -0,0 +1,180 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" collect every Sugar profile of a shared machine in one pass
+
+Meant to be run by root, for instance from cron, with the harvest
+package in the python path:
+
+    python -m harvest.profiles
+
+Every profile is collected in its own process, as its user and out of
+its files, and what was queued is sent once all are done. A profile that
+is being collected already, by its session, is skipped.
+"""
+
+import os
+import pwd
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing
+
+from .harvest import Harvest
+from .journal import DiskJournal
+from .journal import set_journal
+from .settings import FileSettings
+from .settings import set_settings
+
+PROFILE = '.sugar/default'
+DATASTORE = 'datastore'
+MIN_UID = 500
+NICE = 10
+POLL = 0.1
+
+
+class Profile(object):
+    """ a user with a sugar profile """
+
+    def __init__(self, user):
+        self.name = user.pw_name
+        self.uid = user.pw_uid
+        self.gid = user.pw_gid
+        self.home = user.pw_dir
+
+    def datastore(self):
+        return os.path.join(self.home, PROFILE, DATASTORE)
+
+
+def profiles():
+    """ every profile of the machine, or only ours if not root """
+    users = pwd.getpwall()
+    if os.getuid() != 0:
+        users = [pwd.getpwuid(os.getuid())]
+    for user in users:
+        if os.getuid() == 0 and user.pw_uid < MIN_UID:
+            continue
+        profile = Profile(user)
+        if os.path.isdir(profile.datastore()):
+            yield profile
+
+
+def _enter(profile):
+    """ become the user of the profile, within this worker only """
+    if os.getuid() == 0:
+        os.setgroups([])
+        os.setgid(profile.gid)
+        os.setuid(profile.uid)
+    os.environ['HOME'] = profile.home
+    os.environ['USER'] = os.environ['LOGNAME'] = profile.name
+    os.nice(NICE)
+    set_settings(FileSettings(profile.home))
+    set_journal(DiskJournal(profile.datastore()))
+
+
+def _collect(arguments):
+    profile, forced = arguments
+    _enter(profile)
+    harvest = Harvest(sandbox=False)
+    if not forced and harvest.is_not_enabled():
+        return 'not enabled'
+    return _outcome(harvest.collect, forced, None, False)
+
+
+def _send(profile):
+    _enter(profile)
+    return _outcome(Harvest(sandbox=False).send)
+
+
+def _outcome(function, *args):
+    try:
+        function(*args)
+    except Exception as error:
+        # the error itself may not make it back to the parent
+        if error.__class__.__module__ != 'harvest.errors':
+            traceback.print_exc()
+        return error.__class__.__name__
+    return 'done'
+
+
+def _child(function, argument, connection):
+    connection.send(function(argument))
+    connection.close()
+
+
+def _map(function, arguments, workers):
+    """ the outcome of function for every argument, in order
+
+    Every call runs in a fresh process, nothing is shared between them,
+    and at most workers at once. They are all started from this thread,
+    as harvest expects to be the main thread of its process.
+    """
+    outcomes = [None] * len(arguments)
+    pending = list(enumerate(arguments))
+    running = []
+    while pending or running:
+        while pending and len(running) < workers:
+            number, argument = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(False)
+            process = multiprocessing.Process(target=_child,
+                                              args=(function, argument,
+                                                    sender))
+            process.start()
+            sender.close()
+            running.append((number, process, receiver))
+        time.sleep(POLL)
+        for child in running[:]:
+            number, process, receiver = child
+            if process.is_alive():
+                continue
+            process.join()
+            running.remove(child)
+            try:
+                outcomes[number] = receiver.recv()
+            except EOFError:
+                # it did not get as far as telling
+                outcomes[number] = 'exited %d' % process.exitcode
+            receiver.close()
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--forced', action='store_true',
+                        help='collect even if not enabled or selected')
+    options = parser.parse_args()
+
+    found = list(profiles())
+    if not found:
+        return 0
+
+    workers = max(1, options.workers)
+    collected = _map(_collect, [(profile, options.forced)
+                                for profile in found], workers)
+
+    # every profile tries, some may have crops queued from before
+    sent = _map(_send, found, workers)
+
+    for profile, collect, send in zip(found, collected, sent):
+        print '%s: collect %s, send %s' % (profile.name, collect, send)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+from gi.repository import GLib
+
+from .harvest import Harvest
+
+
+_scheduler = None
+
+
+class Scheduler(object):
+    """ merges collect triggers, with at most one collection in flight """
+
+    DELAY = 5
+
+    def __init__(self):
+        self._harvest = None
+        self._timeout_id = None
+        self._forced = False
+        self._callbacks = []
+        self._running = False
+        self._running_forced = False
+        self._running_callbacks = []
+
+    def trigger(self, forced=False, done_cb=None, progress_cb=None):
+        """ ask for a collection, triggers close in time are merged """
+        callbacks = (done_cb, progress_cb)
+        if self._running and (self._running_forced or not forced):
+            # the collection in flight already covers this trigger
+            self._running_callbacks.append(callbacks)
+            return
+
+        self._callbacks.append(callbacks)
+        if self._running:
+            # start over once the collection in flight is done
+            self._forced = True
+            return
+
+        if self._timeout_id is not None:
+            if not forced or self._forced:
+                return
+            GLib.source_remove(self._timeout_id)
+        self._forced = self._forced or forced
+        self._schedule()
+
+    def _schedule(self):
+        delay = self.DELAY
+        if self._forced:
+            delay = 0
+        self._timeout_id = GLib.timeout_add_seconds(delay, self.__collect_cb)
+
+    def _get_harvest(self):
+        if self._harvest is None:
+            self._harvest = Harvest()
+        return self._harvest
+
+    def __collect_cb(self):
+        self._timeout_id = None
+        forced = self._forced
+        self._forced = False
+        self._running_callbacks = self._callbacks
+        self._callbacks = []
+
+        harvest = self._get_harvest()
+        if not forced and harvest.is_not_enabled():
+            self.__collected_cb(None)
+            return False
+
+        self._running = True
+        self._running_forced = forced
+        harvest.collect_async(self.__collected_cb, forced,
+                              self.__progress_cb)
+        return False
+
+    def __progress_cb(self, stage):
+        for done_cb, progress_cb in self._running_callbacks:
+            if progress_cb is not None:
+                progress_cb(stage)
+
+    def __collected_cb(self, error):
+        self._running = False
+        callbacks = self._running_callbacks
+        self._running_callbacks = []
+        for done_cb, progress_cb in callbacks:
+            if done_cb is not None:
+                done_cb(error)
+
+        if self._callbacks:
+            self._schedule()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
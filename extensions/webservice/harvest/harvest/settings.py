@@ -0,0 +1,209 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+from xml.etree import ElementTree
+
+from gi.repository import GConf
+
+
+_settings = None
+
+
+class Settings(object):
+    """ every GConf key harvest uses, read once and kept up to date
+
+    What was set out of the session, see FileSettings, is merged in too.
+    """
+
+    DIRECTORIES = ['/desktop/sugar/collaboration', '/desktop/sugar/user']
+    OVERRIDES_FILE = '.harvest/settings'
+    TEMPORARY = '.tmp'
+
+    def __init__(self):
+        self._client = GConf.Client.get_default()
+        self._values = {}
+        self._callbacks = {}
+        self._overrides_path = os.path.join(os.path.expanduser('~'),
+                                            self.OVERRIDES_FILE)
+        self._overrides = {}
+        for directory in self.DIRECTORIES:
+            self._client.add_dir(directory,
+                                 GConf.ClientPreloadType.PRELOAD_ONELEVEL)
+            for entry in self._client.all_entries(directory):
+                self._values[entry.get_key()] = _value(entry.get_value())
+            self._client.notify_add(directory, self.__changed_cb, None)
+        self._load_overrides()
+        for key in self._overrides:
+            self._values[key] = self._merged(key, self._values.get(key))
+
+    def get_int(self, key):
+        value = self._values.get(key)
+        if isinstance(value, bool) or not isinstance(value, int):
+            return 0
+        return value
+
+    def get_bool(self, key):
+        value = self._values.get(key)
+        if not isinstance(value, bool):
+            return False
+        return value
+
+    def get_string(self, key):
+        value = self._values.get(key)
+        if not isinstance(value, basestring):
+            return None
+        return value
+
+    def set_int(self, key, value):
+        self._values[key] = self._merged(key, value)
+        self._client.set_int(key, value)
+
+    def set_string(self, key, value):
+        self._values[key] = value
+        self._client.set_string(key, value)
+
+    def notify_add(self, key, callback):
+        """ call callback with the key whenever its value changes """
+        self._callbacks.setdefault(key, []).append(callback)
+
+    def __changed_cb(self, client, connection, entry, data=None):
+        key = entry.get_key()
+        self._values[key] = self._merged(key, _value(entry.get_value()))
+        for callback in self._callbacks.get(key, []):
+            callback(key)
+
+    def _merged(self, key, value):
+        """ value, unless overridden, the latest of both for timestamps """
+        if key not in self._overrides:
+            return value
+        override = self._overrides[key]
+        if isinstance(override, int) and isinstance(value, int):
+            return max(override, value)
+        return override
+
+    def _load_overrides(self):
+        if not os.path.exists(self._overrides_path):
+            return
+        try:
+            with open(self._overrides_path, 'r') as file:
+                self._overrides = json.load(file)
+        except (IOError, ValueError):
+            self._overrides = {}
+
+    def _save_overrides(self):
+        temporary = self._overrides_path + self.TEMPORARY
+        with open(temporary, 'w') as file:
+            json.dump(self._overrides, file)
+        os.rename(temporary, self._overrides_path)
+
+
+class FileSettings(Settings):
+    """ the same keys, read from the GConf files of another home
+
+    Out of a session GConf can not be reached, let alone safely written,
+    so whatever is set goes to OVERRIDES_FILE instead. Only timestamps
+    are set, so the latest of both wins, here and back in the session.
+    """
+
+    DEFAULTS = '/etc/gconf/gconf.xml.defaults/%gconf-tree.xml'
+    MANDATORY = '/etc/gconf/gconf.xml.mandatory/%gconf-tree.xml'
+    USER_FILE = '.gconf%s/%%gconf.xml'
+
+    def __init__(self, home):
+        self._values = {}
+        self._callbacks = {}
+        self._overrides_path = os.path.join(home, self.OVERRIDES_FILE)
+        self._overrides = {}
+
+        self._read(self.DEFAULTS, '')
+        for directory in self.DIRECTORIES:
+            self._read(os.path.join(home, self.USER_FILE % directory),
+                       directory)
+        self._load_overrides()
+        for key in self._overrides:
+            self._values[key] = self._merged(key, self._values.get(key))
+        self._read(self.MANDATORY, '')
+
+    def set_int(self, key, value):
+        self._values[key] = value
+        self._overrides[key] = value
+        self._save_overrides()
+
+    def set_string(self, key, value):
+        self._values[key] = value
+        self._overrides[key] = value
+        self._save_overrides()
+
+    def _read(self, path, directory):
+        if not os.path.exists(path):
+            return
+        try:
+            root = ElementTree.parse(path).getroot()
+        except (IOError, ElementTree.ParseError):
+            return
+        for key, value in _entries(root, directory):
+            if os.path.dirname(key) in self.DIRECTORIES and \
+               value is not None:
+                self._values[key] = value
+
+
+def _entries(element, directory):
+    """ (key, value) pairs of every entry within a GConf XML element """
+    for child in element:
+        if child.tag == 'dir':
+            for entry in _entries(child, '%s/%s' % (directory,
+                                                    child.get('name'))):
+                yield entry
+        elif child.tag == 'entry':
+            yield '%s/%s' % (directory, child.get('name')), _xml_value(child)
+
+
+def _xml_value(entry):
+    type = entry.get('type')
+    if type == 'int':
+        return int(entry.get('value'))
+    if type == 'bool':
+        return entry.get('value') == 'true'
+    if type == 'string':
+        return entry.findtext('stringvalue') or ''
+    return None
+
+
+def _value(value):
+    if value is None:
+        return None
+    if value.type == GConf.ValueType.INT:
+        return value.get_int()
+    if value.type == GConf.ValueType.BOOL:
+        return value.get_bool()
+    if value.type == GConf.ValueType.STRING:
+        return value.get_string()
+    return None
+
+
+def get_settings():
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
+
+
+def set_settings(settings):
+    """ use other settings than the session ones, see FileSettings """
+    global _settings
+    _settings = settings
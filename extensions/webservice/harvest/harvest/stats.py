@@ -0,0 +1,95 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import json
+import time
+import contextlib
+
+from .harvest_logger import get_logger
+
+
+_stats = None
+
+
+class Stats(object):
+    """ timings and sizes of every phase of the current collection
+
+    A record is logged when the collection ends and, when asked to,
+    also kept along with the previous ones in a JSON stats file.
+    """
+
+    STATS_FILE = '~/.harvest/stats'
+    TEMPORARY = '.tmp'
+    MAX_RECORDS = 64
+
+    def __init__(self):
+        self._path = os.path.expanduser(self.STATS_FILE)
+        self._logger = get_logger()
+        self.begin()
+
+    def begin(self):
+        """ start a new record """
+        self._record = {}
+        self._record['started'] = int(time.time())
+        self._record['timings'] = {}
+        self._record['counts'] = {}
+
+    @contextlib.contextmanager
+    def timing(self, phase):
+        """ add the time spent within the block to phase """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - started)
+
+    def add_time(self, phase, seconds):
+        timings = self._record['timings']
+        timings[phase] = round(timings.get(phase, 0) + seconds, 6)
+
+    def count(self, name, value=1):
+        counts = self._record['counts']
+        counts[name] = counts.get(name, 0) + value
+
+    def end(self, outcome, save=False):
+        """ log the record and optionally keep it in the stats file """
+        self._record['outcome'] = outcome
+        self._logger.info('stats %s.' %
+                          json.dumps(self._record, sort_keys=True))
+        if save:
+            self._save()
+
+    def _save(self):
+        records = []
+        if os.path.exists(self._path):
+            try:
+                with open(self._path, 'r') as file:
+                    records = json.load(file)
+            except (IOError, ValueError):
+                self._logger.debug('discarded unreadable stats.')
+        records.append(self._record)
+        temporary = self._path + self.TEMPORARY
+        with open(temporary, 'w') as file:
+            json.dump(records[-self.MAX_RECORDS:], file)
+        os.rename(temporary, self._path)
+
+
+def get_stats():
+    global _stats
+    if _stats is None:
+        _stats = Stats()
+    return _stats
@@ -0,0 +1,159 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import struct
+import threading
+
+from gi.repository import Soup
+
+from .compression import decompressor
+from .worker import in_main_thread
+from .worker import call_in_main
+
+
+_uploader = None
+
+
+class Uploader(object):
+    """ one asynchronous session shared by every upload """
+
+    TIMEOUT = 60
+    IDLE_TIMEOUT = 30
+    MAX_CONNS = 2
+    # bytes per second of the slowest link still worth waiting for
+    MIN_RATE = 4096
+
+    def __init__(self):
+        self._session = Soup.SessionAsync()
+        self._session.props.timeout = self.TIMEOUT
+        self._session.props.idle_timeout = self.IDLE_TIMEOUT
+        self._session.props.max_conns_per_host = self.MAX_CONNS
+        self._session.add_feature_by_type(Soup.ProxyResolverDefault)
+
+    def send_async(self, message, done_cb):
+        """ queue message, done_cb receives it once it has completed """
+        self._session.queue_message(message, self.__sent_cb, done_cb)
+
+    def __sent_cb(self, session, message, done_cb):
+        done_cb(message)
+
+    def send(self, message):
+        """ send message and block until it has completed """
+        if in_main_thread():
+            # the async session iterates the main loop until it is done
+            self._session.send_message(message)
+            return message
+
+        # otherwise let the main loop drive it and wait for the result
+        event = threading.Event()
+        call_in_main(self.send_async, message, lambda message: event.set())
+        if not event.wait(self._patience(message)):
+            # don't leave it running, a late 200 would go unnoticed
+            call_in_main(self._cancel, message, event)
+            event.wait(self.TIMEOUT)
+        return message
+
+    def _patience(self, message):
+        """ how long to wait for message, longer the larger its body is """
+        length = message.request_headers.get_content_length() or \
+            message.request_body.length or 0
+        return self.TIMEOUT * 2 + length / self.MIN_RATE
+
+    def _cancel(self, message, event):
+        # it may have just completed, on the main loop too
+        if not event.is_set():
+            self._session.cancel_message(message, Soup.Status.CANCELLED)
+
+    def abort(self):
+        """ cancel every pending upload """
+        self._session.abort()
+
+
+class FileBody(object):
+    """ feeds a request body from a file, one block at a time
+
+    A gzip file can also be sent decompressed on the fly, its length is
+    taken from the gzip trailer.
+    """
+
+    BLOCK_SIZE = 65536
+
+    def __init__(self, message, path, decompress=False):
+        self._path = path
+        self._decompress = decompress
+        self._file = None
+        self._decompressor = None
+
+        message.request_headers.set_content_type('application/json', None)
+        message.request_headers.set_content_length(self._length())
+        message.request_body.set_accumulate(False)
+        message.connect('wrote-headers', self.__write_cb)
+        message.connect('wrote-chunk', self.__write_cb)
+        message.connect('restarted', self.__restarted_cb)
+        message.connect('finished', self.__finished_cb)
+
+    def _length(self):
+        with open(self._path, 'rb') as file:
+            if not self._decompress:
+                file.seek(0, 2)
+                return file.tell()
+            file.seek(-4, 2)
+            return struct.unpack('<I', file.read(4))[0]
+
+    def _open(self):
+        self._close()
+        self._file = open(self._path, 'rb')
+        if self._decompress:
+            self._decompressor = decompressor()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read(self):
+        while True:
+            block = self._file.read(self.BLOCK_SIZE)
+            if not self._decompress:
+                return block
+            if not block:
+                return self._decompressor.flush()
+            block = self._decompressor.decompress(block)
+            if block:
+                return block
+
+    def __write_cb(self, message):
+        if self._file is None:
+            self._open()
+        block = self._read()
+        if block:
+            message.request_body.append(block)
+        else:
+            message.request_body.complete()
+            self._close()
+
+    def __restarted_cb(self, message):
+        self._close()
+
+    def __finished_cb(self, message):
+        self._close()
+
+
+def get_uploader():
+    global _uploader
+    if _uploader is None:
+        _uploader = Uploader()
+    return _uploader
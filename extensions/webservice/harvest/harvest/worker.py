@@ -0,0 +1,69 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+from gi.repository import GObject
+
+GObject.threads_init()
+dbus.mainloop.glib.threads_init()
+
+# the thread that imports it is the one running the main loop
+_main_thread = threading.current_thread()
+
+
+def in_main_thread():
+    return threading.current_thread() is _main_thread
+
+
+def call_in_main(function, *args):
+    """ run function on the main loop, right away if already there """
+    if in_main_thread():
+        function(*args)
+    else:
+        GLib.idle_add(_call_once, function, args)
+
+
+def _call_once(function, args):
+    function(*args)
+    return False
+
+
+class Worker(threading.Thread):
+    """ runs a blocking job away from the main loop """
+
+    def __init__(self, function, done_cb, progress_cb=None):
+        threading.Thread.__init__(self, name='HarvestWorker')
+        self.daemon = True
+        self._function = function
+        self._done_cb = done_cb
+        self._progress_cb = progress_cb
+
+    def run(self):
+        error = None
+        try:
+            self._function(self.progress)
+        except Exception as e:
+            error = e
+        call_in_main(self._done_cb, error)
+
+    def progress(self, stage):
+        """ report a stage of the job, delivered on the main loop """
+        if self._progress_cb is not None:
+            call_in_main(self._progress_cb, stage)
@@ -14,6 +14,13 @@ BuildArch:      noarch
 %description
 Client for the Harvest Project that aims to make learning visible to educators and decision makers
 
+%package relay
+Summary:        Relay for the Harvest Project, for school servers
+Requires:       python >= 2.7
+
+%description relay
+Collects crops from the laptops of a school and forwards them to the Harvest server in batches
+
 %prep
 %setup -q
 
@@ -31,6 +38,9 @@ cp -r extensions/cpsection/webaccount/services/harvest $RPM_BUILD_ROOT/%{_datadi
 mkdir -p $RPM_BUILD_ROOT/%{_sysconfdir}/NetworkManager/dispatcher.d
 cp etc/harvest-collect-ifup $RPM_BUILD_ROOT/%{_sysconfdir}/NetworkManager/dispatcher.d
 
+mkdir -p $RPM_BUILD_ROOT/%{_bindir}
+cp relay/harvest-relay $RPM_BUILD_ROOT/%{_bindir}/
+
 %clean
 rm -rf $RPM_BUILD_ROOT
 
@@ -40,12 +50,29 @@ rm -rf $RPM_BUILD_ROOT
 %{_datadir}/sugar/extensions/webservice/harvest/harvest/__init__.py
 %{_datadir}/sugar/extensions/webservice/harvest/harvest/harvest_logger.py
 %{_datadir}/sugar/extensions/webservice/harvest/harvest/errors.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/capabilities.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/collector.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/compression.py
 %{_datadir}/sugar/extensions/webservice/harvest/harvest/crop.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/cursor.py
 %{_datadir}/sugar/extensions/webservice/harvest/harvest/harvest.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/identity.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/index.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/journal.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/outbox.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/profiles.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/scheduler.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/settings.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/stats.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/uploader.py
+%{_datadir}/sugar/extensions/webservice/harvest/harvest/worker.py
 %{_datadir}/sugar/extensions/cpsection/webaccount/services/harvest/__init__.py
 %{_datadir}/sugar/extensions/cpsection/webaccount/services/harvest/service.py
 %{_sysconfdir}/NetworkManager/dispatcher.d/harvest-collect-ifup
 
+%files relay
+%{_bindir}/harvest-relay
+
 %changelog
 * Wed Feb 05 2014 Martin Abente Lahaye <tch@sugarlabs.org>
 - Support not enabling automatic collection
@@ -0,0 +1,142 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" what the tests use in place of the Sugar shell and its Journal """
+
+import os
+import imp
+import sys
+import logging
+
+PACKAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'extensions', 'webservice', 'harvest',
+                            'harvest')
+
+
+def _module(name, **attributes):
+    module = imp.new_module(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def _missing(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return True
+    return False
+
+
+def install():
+    """ import the harvest package without the Sugar shell around it """
+    if 'harvest' in sys.modules:
+        return
+    if _missing('gi.repository.GConf'):
+        gi = _module('gi')
+        gi.repository = _module('gi.repository')
+        gi.repository.Soup = _module('gi.repository.Soup')
+        gi.repository.GConf = _module('gi.repository.GConf')
+        gi.repository.GLib = _module('gi.repository.GLib',
+                                     idle_add=lambda *args: None)
+        gi.repository.GObject = _module('gi.repository.GObject',
+                                        threads_init=lambda: None)
+    if _missing('dbus.mainloop.glib'):
+        dbus = _module('dbus')
+        dbus.mainloop = _module('dbus.mainloop')
+        dbus.mainloop.glib = _module('dbus.mainloop.glib',
+                                     threads_init=lambda: None)
+    if _missing('sugar3.datastore.datastore'):
+        sugar3 = _module('sugar3')
+        sugar3.datastore = _module('sugar3.datastore')
+        sugar3.datastore.datastore = _module('sugar3.datastore.datastore')
+
+    # skip the package __init__, it pulls the whole shell integration
+    package = imp.new_module('harvest')
+    package.__path__ = [os.path.abspath(PACKAGE_PATH)]
+    sys.modules['harvest'] = package
+
+    from harvest import harvest_logger
+    harvest_logger._logger = logging.getLogger('harvest-test')
+    harvest_logger._logger.addHandler(logging.NullHandler())
+
+
+class Metadata(object):
+
+    def __init__(self, properties):
+        self._properties = properties
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+
+class Entry(object):
+
+    def __init__(self, object_id, properties):
+        self._object_id = object_id
+        self.metadata = Metadata(properties)
+
+    def get_object_id(self):
+        return self._object_id
+
+
+class Journal(object):
+    """ entries kept in memory, found as sugar3.datastore finds them """
+
+    def __init__(self):
+        self.entries = {}
+
+    def save(self, object_id, timestamp, activity='org.laptop.Chat',
+             launches=None):
+        self.entries[object_id] = {
+            'uid': object_id,
+            'activity': activity,
+            'filesize': '1024',
+            'creation_time': str(timestamp),
+            'timestamp': str(timestamp),
+            'share-scope': 'private',
+            'title_set_by_user': '0',
+            'keep': '0',
+            'mime_type': 'text/plain',
+            'launch-times': ', '.join(str(launch) for launch in
+                                      (launches or [timestamp]))}
+
+    def delete(self, object_id):
+        del self.entries[object_id]
+
+    def find(self, query, sorting=None, limit=None, offset=None,
+             properties=None):
+        window = query.get('timestamp', {})
+        start, end = window.get('start'), window.get('end')
+        matches = []
+        for object_id, metadata in self.entries.iteritems():
+            timestamp = int(metadata['timestamp'])
+            if (start is None or timestamp >= start) and \
+               (end is None or timestamp <= end):
+                matches.append((timestamp, object_id))
+        matches.sort()
+        total = len(matches)
+        matches = matches[offset or 0:]
+        if limit is not None:
+            matches = matches[:limit]
+        entries = []
+        for timestamp, object_id in matches:
+            metadata = self.entries[object_id]
+            if properties:
+                metadata = dict((key, value) for key, value in
+                                metadata.iteritems() if key in properties)
+            entries.append(Entry(object_id, metadata))
+        return entries, total
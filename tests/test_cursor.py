@@ -0,0 +1,122 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" growing the cursor log, against a stand-in Journal """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import standins
+standins.install()
+
+from harvest import journal
+from harvest.cursor import Cursor
+
+
+class CursorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self.path = os.path.join(self._path, 'cursor')
+        self.journal = standins.Journal()
+        journal.set_journal(self.journal)
+        for number in xrange(10):
+            self.journal.save('id%d' % number, 1000 + number)
+
+    def tearDown(self):
+        journal.set_journal(None)
+        shutil.rmtree(self._path)
+
+    def _log(self):
+        with open(self.path + Cursor.INSTANCES, 'r') as file:
+            return file.read()
+
+    def _gathered(self, cursor):
+        return dict((instance.object_id, instance.timestamp)
+                    for instances in cursor.activities().itervalues()
+                    for instance in instances)
+
+    def test_grow_only_appends(self):
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1009)
+        log = self._log()
+
+        self.journal.save('id3', 1010)
+        self.journal.save('id10', 1011)
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1011)
+
+        self.assertTrue(self._log().startswith(log))
+        # id9 too, the window starts where the last one ended
+        self.assertEqual(len(self._log().splitlines()), 13)
+        self.assertFalse(cursor.empty())
+
+    def test_last_row_wins_and_compacts(self):
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1009)
+        self.journal.save('id3', 1010)
+        cursor.grow(1010)
+
+        gathered = self._gathered(Cursor(self.path, 1000))
+        self.assertEqual(len(gathered), 10)
+        self.assertEqual(gathered['id3'], 1010)
+        self.assertEqual(len(self._log().splitlines()), 10)
+
+    def test_interrupted_append_is_gathered_again(self):
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1005)
+        with open(self.path + Cursor.INSTANCES, 'a') as file:
+            file.write('["org.laptop.Chat",["id6",10')
+
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1009)
+
+        self.assertEqual(sorted(self._gathered(cursor)),
+                         sorted('id%d' % number for number in xrange(10)))
+
+    def test_unreadable_log_is_gathered_again(self):
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1009)
+        with open(self.path + Cursor.INSTANCES, 'w') as file:
+            file.write('garbage\n')
+
+        cursor = Cursor(self.path, 1000)
+        self.assertEqual(len(self._gathered(cursor)), 10)
+
+    def test_other_window_starts_over(self):
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1009)
+
+        cursor = Cursor(self.path, 1005)
+        cursor.grow(1009)
+
+        self.assertEqual(sorted(self._gathered(cursor)),
+                         ['id5', 'id6', 'id7', 'id8', 'id9'])
+
+    def test_reset(self):
+        cursor = Cursor(self.path, 1000)
+        cursor.grow(1009)
+        cursor.reset(1009)
+
+        self.assertTrue(cursor.empty())
+        self.assertEqual(self._log(), '')
+        self.assertEqual(self._gathered(Cursor(self.path, 1009)), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,469 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" sending queued crops, against stand-in Soup messages and server """
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+import subprocess
+import zlib
+
+import standins
+standins.install()
+
+from harvest import harvest
+from harvest import uploader
+from harvest import settings
+from harvest.errors import BusyError
+from harvest.errors import SendError
+
+WBITS = zlib.MAX_WBITS | 16
+
+
+def compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data):
+    return zlib.decompress(data, WBITS)
+
+
+class Headers(object):
+
+    def __init__(self, headers=None):
+        self._headers = dict((name.lower(), str(value))
+                             for name, value in (headers or {}).items())
+
+    def append(self, name, value):
+        self._headers[name.lower()] = value
+
+    def get_one(self, name):
+        return self._headers.get(name.lower())
+
+    def set_content_type(self, content_type, parameters):
+        self.append('Content-Type', content_type)
+
+    def set_content_length(self, length):
+        self.append('Content-Length', str(length))
+
+    def get_content_length(self):
+        return int(self.get_one('Content-Length') or 0)
+
+
+class Body(object):
+
+    def __init__(self):
+        self.data = ''
+        self.completed = False
+
+    @property
+    def length(self):
+        return len(self.data)
+
+    def set_accumulate(self, accumulate):
+        pass
+
+    def append(self, data):
+        self.data += data
+
+    def complete(self):
+        self.completed = True
+
+
+class Message(object):
+    """ just what harvest uses of a Soup.Message """
+
+    def __init__(self, method, uri):
+        self.method = method
+        self.uri = uri
+        self.request_headers = Headers()
+        self.request_body = Body()
+        self.response_headers = Headers()
+        self.status_code = 0
+        self._handlers = {}
+
+    def set_request(self, content_type, use, data, length):
+        self.request_headers.set_content_type(content_type, None)
+        self.request_body.append(data[:length])
+        self.request_body.complete()
+
+    def connect(self, signal, callback):
+        self._handlers.setdefault(signal, []).append(callback)
+
+    def emit(self, signal):
+        for callback in self._handlers.get(signal, []):
+            callback(self)
+
+
+class Soup(object):
+
+    class URI(object):
+
+        @staticmethod
+        def new(uri):
+            return uri
+
+    class MemoryUse(object):
+        COPY = 2
+
+    class Status(object):
+        CANCELLED = 1
+
+    Message = Message
+
+
+class Server(object):
+    """ answers messages in place of the session, as the server would """
+
+    def __init__(self, chunks=True, gzip=True):
+        self.chunks = chunks
+        self.gzip = gzip
+        # how batches are answered, and what is said about them
+        self.batch = 404
+        self.advertised = {}
+        self.uploads = {}
+        self.crops = []
+        self.messages = []
+        # status and headers of the next chunk answers, instead of the usual
+        self.answers = []
+
+    def send(self, message):
+        # feed a streamed body as the session would
+        message.emit('wrote-headers')
+        while not message.request_body.completed:
+            message.emit('wrote-chunk')
+        message.emit('finished')
+        self.messages.append(message)
+
+        headers = message.request_headers
+        body = message.request_body.data
+        status, response = 404, {}
+        if message.uri.endswith(harvest.Harvest.CHUNKS_ENDPOINT):
+            if self.chunks:
+                status, response = self._chunk(headers, body)
+        elif message.uri.endswith(harvest.Harvest.BATCH_ENDPOINT):
+            status = self.batch
+            if status == 200:
+                if headers.get_one('Content-Encoding') == 'gzip':
+                    body = decompress(body)
+                self.crops.extend(item['crop'] for item in json.loads(body))
+        elif message.uri.endswith(harvest.Harvest.ENDPOINT):
+            if headers.get_one('Content-Encoding') == 'gzip':
+                body = decompress(body)
+            self.crops.append(json.loads(body))
+            status = 200
+        if self.gzip:
+            response['Accept-Encoding'] = 'gzip'
+        response['x-harvest-chunks'] = int(self.chunks)
+        response.update(self.advertised)
+        message.status_code = status
+        message.response_headers = Headers(response)
+        return message
+
+    def _chunk(self, headers, body):
+        if self.answers:
+            return self.answers.pop(0)
+        upload = headers.get_one(harvest.Harvest.UPLOAD_HEADER)
+        offset = int(headers.get_one(harvest.Harvest.OFFSET_HEADER))
+        size = int(headers.get_one(harvest.Harvest.SIZE_HEADER))
+        received = self.uploads.setdefault(upload, '')
+        if offset != len(received):
+            return 409, {harvest.Harvest.OFFSET_HEADER: len(received)}
+        received += body
+        self.uploads[upload] = received
+        if len(received) == size:
+            crop = received
+            if headers.get_one(harvest.Harvest.ENCODING_HEADER) == 'gzip':
+                crop = decompress(crop)
+            self.crops.append(json.loads(crop))
+        return 200, {harvest.Harvest.OFFSET_HEADER: len(received)}
+
+
+class Settings(object):
+
+    def __init__(self):
+        self.values = {}
+
+    def get_int(self, key):
+        return self.values.get(key, 0)
+
+    def get_bool(self, key):
+        return False
+
+    def get_string(self, key):
+        return self.values.get(key)
+
+    def set_int(self, key, value):
+        self.values[key] = value
+
+
+class DrainTest(unittest.TestCase):
+
+    CHUNK_SIZE = 1024
+
+    def setUp(self):
+        self._home = tempfile.mkdtemp()
+        self._environ = os.environ.get('HOME')
+        os.environ['HOME'] = self._home
+
+        self.settings = Settings()
+        self.settings.values[harvest.Harvest.HOSTNAME] = \
+            'http://harvest.example.org'
+        self.settings.values[harvest.Harvest.API_KEY] = 'secret'
+        settings._settings = self.settings
+        self.server = Server()
+        uploader._uploader = self.server
+        self._soup = harvest.Soup, uploader.Soup
+        harvest.Soup = uploader.Soup = Soup
+
+        self.harvest = harvest.Harvest()
+        self.harvest.CHUNK_SIZE = self.CHUNK_SIZE
+        self.harvest._capabilities._data.update(gzip=True, chunks=True)
+        self.outbox = self.harvest._outbox
+
+    def tearDown(self):
+        harvest.Soup, uploader.Soup = self._soup
+        uploader._uploader = None
+        settings._settings = None
+        os.environ['HOME'] = self._environ
+        shutil.rmtree(self._home)
+
+    def _queue(self, entries, start, end, changes=None):
+        generator = random.Random(end)
+        crop = [['SHC00000001'], [start, 'female'],
+                {'org.laptop.Chat': [['%040x' % generator.getrandbits(160)]
+                                     for entry in xrange(entries)]}]
+        writer = self.outbox.writer(start, end)
+        writer.write(compress(json.dumps(crop)))
+        if changes is not None:
+            with open(writer.changes_path, 'w') as file:
+                json.dump(changes, file)
+        writer.commit('000312')
+        return crop
+
+    def _chunks(self):
+        return [message for message in self.server.messages
+                if message.uri.endswith(harvest.Harvest.CHUNKS_ENDPOINT)]
+
+    def test_large_crop_in_chunks(self):
+        crop = self._queue(200, 0, 100)
+        record = self.outbox.records()[0]
+        self.assertTrue(record.size > self.CHUNK_SIZE)
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, [crop])
+        self.assertTrue(self.outbox.empty())
+        self.assertEqual(self.settings.values[harvest.Harvest.TIMESTAMP],
+                         100)
+        chunks = self._chunks()
+        self.assertEqual(len(chunks), (record.size - 1) //
+                         self.CHUNK_SIZE + 1)
+        for message in chunks:
+            headers = message.request_headers
+            self.assertEqual(headers.get_one('Content-Type'),
+                             'application/octet-stream')
+            self.assertEqual(headers.get_one('Content-Encoding'), None)
+            self.assertEqual(headers.get_one('x-harvest-encoding'), 'gzip')
+            self.assertEqual(headers.get_one('x-harvest-upload'),
+                             record.checksum)
+
+    def test_resume_where_the_server_is(self):
+        crop = self._queue(200, 0, 100)
+        record = self.outbox.records()[0]
+        with open(record.path, 'rb') as file:
+            self.server.uploads[record.checksum] = \
+                file.read(self.CHUNK_SIZE * 2)
+
+        self.assertTrue(self.harvest._send_chunks(record))
+        self.assertEqual(self.server.crops, [crop])
+        offsets = [int(message.request_headers.get_one('x-harvest-offset'))
+                   for message in self._chunks()]
+        self.assertEqual(offsets[:2], [0, self.CHUNK_SIZE * 2])
+
+    def test_unanswered_chunk_is_kept_for_later(self):
+        self._queue(200, 0, 100)
+        self.server.answers = [(200, {}), (200, {'x-harvest-offset': 'x'})]
+
+        self.assertRaises(SendError, self.harvest._drain)
+        self.assertRaises(SendError, self.harvest._drain)
+        record = self.outbox.records()[0]
+        self.assertEqual(self.outbox.offset(record), 0)
+
+        self.harvest._drain()
+        self.assertTrue(self.outbox.empty())
+
+    def test_chunks_not_supported(self):
+        crop = self._queue(200, 0, 100)
+        self.server.chunks = False
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, [crop])
+        self.assertTrue(self.outbox.empty())
+        self.assertEqual(self.harvest._capabilities.accepts_chunks(), False)
+        self.assertEqual(len(self._chunks()), 1)
+
+    def test_not_chunked_without_gzip(self):
+        crop = self._queue(200, 0, 100)
+        self.harvest._capabilities._data['gzip'] = False
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, [crop])
+        self.assertEqual(self._chunks(), [])
+        self.assertEqual(self.server.messages[0].request_headers.get_one(
+            'Content-Encoding'), None)
+
+    def test_small_crops_after_a_large_one(self):
+        large = self._queue(200, 0, 100)
+        small = self._queue(1, 100, 200)
+        self.harvest._capabilities._data['batch'] = False
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, [large, small])
+        self.assertTrue(self.outbox.empty())
+        self.assertEqual(self.settings.values[harvest.Harvest.TIMESTAMP],
+                         200)
+
+    def _batches(self):
+        return [message for message in self.server.messages
+                if message.uri.endswith(harvest.Harvest.BATCH_ENDPOINT)]
+
+    def test_small_crops_in_a_batch(self):
+        crops = [self._queue(1, end - 100, end) for end in [100, 200, 300]]
+        self.server.batch = 200
+        self.server.advertised['x-harvest-batch'] = 1
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, crops)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertTrue(self.outbox.empty())
+
+    def test_large_crops_not_in_a_batch(self):
+        small = self._queue(1, 0, 100)
+        large = self._queue(200, 100, 200)
+        self.server.batch = 200
+        self.server.advertised['x-harvest-batch'] = 1
+        self.server.gzip = False
+        self.harvest._capabilities._data['gzip'] = False
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, [small, large])
+        self.assertEqual(self._batches(), [])
+        self.assertEqual(self._chunks(), [])
+        self.assertTrue(self.outbox.empty())
+
+    def test_batch_never_advertised_fails(self):
+        crops = [self._queue(1, end - 100, end) for end in [100, 200, 300]]
+        self.server.batch = 400
+
+        self.harvest._drain()
+
+        self.assertEqual(self.server.crops, crops)
+        self.assertEqual(len(self._batches()), 1)
+        self.assertEqual(self.harvest._capabilities.accepts_batch(), False)
+        self.assertTrue(self.outbox.empty())
+
+    def test_advertised_batch_fails(self):
+        [self._queue(1, end - 100, end) for end in [100, 200, 300]]
+        self.server.batch = 500
+        self.server.advertised['x-harvest-batch'] = 1
+        self.harvest._capabilities._data['batch'] = True
+
+        self.assertRaises(SendError, self.harvest._drain)
+        self.assertEqual(self.server.crops, [])
+        self.assertEqual(self.harvest._capabilities.accepts_batch(), True)
+        self.assertEqual(len(self.outbox.records()), 3)
+
+    def _index(self):
+        with open(self.harvest._index_path, 'r') as file:
+            return json.load(file)
+
+    def test_index_updated_once_delivered(self):
+        self._queue(1, 0, 100, {'id1': [1, 2, 1], 'id2': [3, 4, 1]})
+        self._queue(1, 100, 200, {'id1': [1, 5, 2], 'id2': None})
+        self.harvest._capabilities._data['batch'] = False
+        saved = []
+        index = self.harvest._get_index()
+        index._save = lambda: saved.append(dict(index._entries))
+
+        self.harvest._drain()
+
+        self.assertEqual(saved, [{'id1': [1, 5, 2]}])
+
+    def test_index_kept_when_not_delivered(self):
+        self._queue(1, 0, 100, {'id1': [1, 2, 1]})
+        self._queue(200, 100, 200, {'id2': [3, 4, 1]})
+        self.server.answers = [(200, {})]
+
+        self.assertRaises(SendError, self.harvest._drain)
+
+        # only what the first crop carried, the second one is still queued
+        self.assertEqual(self._index(), {'id1': [1, 2, 1]})
+        [record] = self.outbox.records()
+        self.assertEqual(self.outbox.changes(record), {'id2': [3, 4, 1]})
+
+    def test_busy_while_another_process_holds_it(self):
+        self._queue(1, 0, 100)
+        holder = subprocess.Popen(
+            [sys.executable, '-c', 'import fcntl, sys\n'
+             'file = open(sys.argv[1], "a")\n'
+             'fcntl.lockf(file, fcntl.LOCK_EX)\n'
+             'print "locked"\n'
+             'sys.stdout.flush()\n'
+             'sys.stdin.read()\n', self.harvest._lock_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            holder.stdout.readline()
+            self.assertRaises(BusyError, self.harvest.send)
+            self.assertEqual(self.server.messages, [])
+        finally:
+            holder.communicate()
+
+        self.harvest.send()
+        self.assertTrue(self.outbox.empty())
+
+    def test_capabilities_of_another_server(self):
+        self.harvest._capabilities._data['versions'] = ['000312', '000420']
+        self.harvest._load_settings()
+        self.assertTrue(self.harvest._capabilities.accepts_gzip())
+
+        self.settings.values[harvest.Harvest.HOSTNAME] = \
+            'http://relay.example.org'
+        self.harvest._load_settings()
+        self.assertFalse(self.harvest._capabilities.accepts_gzip())
+        self.assertEqual(self.harvest._formats(), (False, False))
+
+        # and it is remembered which server it learns from now
+        self.harvest._capabilities.forget_gzip()
+        restarted = harvest.Harvest()
+        self.assertEqual(restarted._capabilities._data,
+                         {'hostname': 'http://relay.example.org',
+                          'gzip': False})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" delta crops and the index behind them, against a stand-in Journal """
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import standins
+standins.install()
+
+from harvest import journal
+from harvest import settings
+from harvest.crop import Crop
+from harvest.index import Index
+
+
+class Settings(object):
+
+    def get_int(self, key):
+        return 0
+
+    def get_string(self, key):
+        return 'female'
+
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._home = tempfile.mkdtemp()
+        self._environ = os.environ.get('HOME')
+        os.environ['HOME'] = self._home
+        os.makedirs(os.path.join(self._home, '.harvest'))
+        settings._settings = Settings()
+
+        self.path = os.path.join(self._home, 'index')
+        self.journal = standins.Journal()
+        journal.set_journal(self.journal)
+        self.journal.save('id1', 1001, launches=[1001, 1002])
+        self.journal.save('id2', 1002, activity='org.laptop.Write')
+
+    def tearDown(self):
+        journal.set_journal(None)
+        settings._settings = None
+        os.environ['HOME'] = self._environ
+        shutil.rmtree(self._home)
+
+    def _crop(self, columnar=False):
+        """ collect a delta crop and deliver it, as harvest would """
+        index = Index(self.path)
+        crop = Crop(start=1000, end=2000, columnar=columnar, index=index)
+        crop.collect()
+        data = None
+        if crop.grown():
+            data = json.loads(crop.serialize())
+        index.update(index.changes())
+        index.save()
+        return crop.version(), data
+
+    def _changed(self):
+        # id1 is launched once more and id2 is left as it was
+        self.journal.save('id1', 1003, launches=[1001, 1002, 1003])
+
+    def test_delta(self):
+        version, data = self._crop()
+        self.assertEqual(version, '000320')
+        activities = data[2]
+        self.assertEqual(sorted(activities), ['org.laptop.Chat',
+                                              'org.laptop.Write'])
+        self.assertEqual(activities['org.laptop.Chat'][0][5], None)
+        self.assertEqual(activities['org.laptop.Chat'][0][10],
+                         [1001, 1002])
+
+        self._changed()
+        version, data = self._crop()
+        self.assertEqual(data[2].keys(), ['org.laptop.Chat'])
+        [row] = data[2]['org.laptop.Chat']
+        self.assertEqual(row[0], 'id1')
+        self.assertEqual(row[5], 2)
+        self.assertEqual(row[10], [1003])
+
+        self.assertEqual(self._crop(), ('000320', None))
+
+    def test_columnar_delta(self):
+        version, data = self._crop(columnar=True)
+        self.assertEqual(version, '000420')
+        strings, activities = data[2]
+        self.assertEqual(len(activities), 2)
+        for activity in activities:
+            self.assertEqual(len(activity), len(Crop.DELTA_COLUMNS) + 1)
+
+        self._changed()
+        version, data = self._crop(columnar=True)
+        strings, [activity] = data[2]
+        self.assertEqual(strings[activity[0]], 'org.laptop.Chat')
+        self.assertEqual(activity[1], ['id1'])
+        self.assertEqual(activity[6], [2])
+        self.assertEqual(strings[activity[10][0]], 'text/plain')
+        self.assertEqual(activity[11], [[1003]])
+
+    def test_nothing_written_until_saved(self):
+        index = Index(self.path)
+        Crop(start=1000, end=2000, index=index).collect()
+        index.update(index.changes())
+        self.assertFalse(os.path.exists(self.path))
+
+        index.save()
+        self.assertEqual(sorted(Index(self.path)._entries), ['id1', 'id2'])
+
+    def test_undelivered_changes_are_sent_again(self):
+        self._crop()
+        self._changed()
+        index = Index(self.path)
+        Crop(start=1000, end=2000, index=index).collect()
+        self.assertEqual(index.changes().keys(), ['id1'])
+
+        # the crop was not delivered, so the server still lacks it
+        index = Index(self.path)
+        crop = Crop(start=1000, end=2000, index=index)
+        crop.collect()
+        self.assertEqual(json.loads(crop.serialize())[2]['org.laptop.Chat'],
+                         [['id1', 1024, 1003, 1003, None, 2, False, False,
+                           False, 'text/plain', [1003]]])
+
+    def test_deleted_entries_are_pruned(self):
+        self._crop()
+        self.journal.delete('id2')
+
+        index = Index(self.path)
+        self.assertEqual(index.prune(Crop().object_ids()), 1)
+        self.assertEqual(index.changes(), {'id2': None})
+        index.update(index.changes())
+        index.save()
+        self.assertEqual(Index(self.path)._entries.keys(), ['id1'])
+
+    def test_nothing_to_prune(self):
+        index = Index(self.path)
+        self.assertEqual(index.prune(None), 0)
+        self.assertEqual(index.changes(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
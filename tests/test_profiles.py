@@ -0,0 +1,53 @@
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" running every profile in a process of its own """
+
+import os
+import unittest
+
+import standins
+standins.install()
+
+from harvest import profiles
+from harvest import worker
+
+
+def _main(argument):
+    return argument, worker.in_main_thread()
+
+
+def _exit(argument):
+    os._exit(argument)
+
+
+class MapTest(unittest.TestCase):
+
+    def test_in_order_and_in_the_main_thread(self):
+        self.assertEqual(profiles._map(_main, range(5), 2),
+                         [(number, True) for number in range(5)])
+
+    def test_in_a_process_of_its_own(self):
+        pids = profiles._map(lambda argument: os.getpid(), range(3), 3)
+        self.assertEqual(len(set(pids)), 3)
+        self.assertFalse(os.getpid() in pids)
+
+    def test_exited_without_an_outcome(self):
+        self.assertEqual(profiles._map(_exit, [3], 1), ['exited 3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" measure crop building against a synthetic, in-memory journal
+
+Every journal size runs in its own process, so the reported peak memory
+of each stage is not skewed by the previous ones.
+"""
+
+import os
+import sys
+import imp
+import json
+import logging
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import traceback
+
+PACKAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'extensions', 'webservice', 'harvest',
+                            'harvest')
+
+START = 1356998400
+# entries held in memory at once to time the extraction of each
+SAMPLE_SIZE = 10000
+ACTIVITIES = [('org.laptop.WebActivity', 'text/uri-list', 20),
+              ('org.laptop.AbiWordActivity', 'application/vnd.oasis.'
+               'opendocument.text', 15),
+              ('org.laptop.TurtleArtActivity', 'application/x-turtle-art',
+               12),
+              ('org.laptop.Oficina', 'image/png', 10),
+              ('org.laptop.Calculate', 'text/plain', 8),
+              ('org.laptop.RecordActivity', 'video/ogg', 6),
+              ('org.laptop.Memorize', 'application/x-memorize-project', 6),
+              ('org.vpri.EtoysActivity', 'application/x-squeak-project', 5),
+              ('org.laptop.physics', 'application/x-physics-activity', 4),
+              ('org.laptop.Chat', 'text/plain', 4),
+              ('org.laptop.sugar.ReadActivity', 'application/pdf', 4),
+              ('org.laptop.ImageViewerActivity', 'image/jpeg', 3),
+              ('org.sugarlabs.Maze', None, 2),
+              ('org.laptop.Pippy', 'text/x-python', 1)]
+
+
+class Metadata(object):
+
+    def __init__(self, properties):
+        self._properties = properties
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+
+class Entry(object):
+
+    def __init__(self, object_id, properties):
+        self._object_id = object_id
+        self.metadata = Metadata(properties)
+
+    def get_object_id(self):
+        return self._object_id
+
+
+class Journal(object):
+    """ stand-in for sugar3.datastore, one entry every spacing seconds
+        from START
+
+    Entries are generated from their index, so even a million of them
+    cost no memory until they are asked for.
+    """
+
+    def __init__(self, count, seed=0, spacing=1):
+        self._count = count
+        self._seed = seed
+        self._spacing = spacing
+        self._weights = []
+        for activity, mime_type, weight in ACTIVITIES:
+            self._weights.extend([(activity, mime_type)] * weight)
+
+    def find(self, query, sorting=None, limit=None, offset=None,
+             properties=None, **kwargs):
+        window = query.get('timestamp', {})
+        # the first index at or after start, the last one at or before end
+        first = max(0, -((START - window.get('start', START)) //
+                         self._spacing))
+        end = window.get('end', START + self._count * self._spacing)
+        last = min(self._count, (end - START) // self._spacing + 1)
+        total = max(0, last - first)
+        first += offset or 0
+        if limit is not None:
+            last = min(last, first + limit)
+        entries = [self._entry(index, properties)
+                   for index in xrange(first, last)]
+        return entries, total
+
+    def _entry(self, index, properties):
+        generator = random.Random(self._seed * 1000003 + index)
+        activity, mime_type = generator.choice(self._weights)
+        timestamp = START + index * self._spacing
+        created = timestamp - generator.randint(0, 86400 * 30)
+        metadata = {}
+        metadata['uid'] = '%08x-%04x-4000-8000-%012x' % (
+            generator.getrandbits(32), generator.getrandbits(16), index)
+        metadata['activity'] = activity
+        metadata['filesize'] = str(int(generator.lognormvariate(9, 2)))
+        metadata['creation_time'] = str(created)
+        metadata['timestamp'] = str(timestamp)
+        metadata['share-scope'] = generator.choice(['private'] * 9 +
+                                                   ['public'])
+        metadata['title_set_by_user'] = generator.choice(['0', '0', '1'])
+        metadata['keep'] = generator.choice(['0'] * 19 + ['1'])
+        if mime_type is not None:
+            metadata['mime_type'] = mime_type
+        launches = sorted(generator.randint(created, timestamp)
+                          for launch in xrange(generator.randint(1, 30)))
+        metadata['launch-times'] = ', '.join(str(l) for l in launches)
+        if generator.random() < 0.1:
+            buddies = {}
+            for buddy in xrange(generator.randint(1, 5)):
+                buddies['%040x' % generator.getrandbits(160)] = \
+                    ['buddy%d' % buddy, '#FF2B34,#005FE4']
+            metadata['buddies'] = json.dumps(buddies)
+        if properties:
+            metadata = dict((key, value) for key, value in metadata.items()
+                            if key in properties)
+        return Entry(metadata.get('uid'), metadata)
+
+
+class Settings(object):
+
+    def get_int(self, key):
+        return START - 86400 * 365 * 10
+
+    def get_string(self, key):
+        return 'female'
+
+    def get_bool(self, key):
+        return False
+
+
+def _install(journal):
+    """ import the harvest package against the stand-ins """
+    datastore = imp.new_module('sugar3.datastore.datastore')
+    datastore.find = journal.find
+    sugar3 = imp.new_module('sugar3')
+    sugar3.datastore = imp.new_module('sugar3.datastore')
+    sugar3.datastore.datastore = datastore
+    sys.modules['sugar3'] = sugar3
+    sys.modules['sugar3.datastore'] = sugar3.datastore
+    sys.modules['sugar3.datastore.datastore'] = datastore
+
+    try:
+        from gi.repository import GConf
+    except ImportError:
+        gi = imp.new_module('gi')
+        gi.repository = imp.new_module('gi.repository')
+        gi.repository.GConf = None
+        sys.modules['gi'] = gi
+        sys.modules['gi.repository'] = gi.repository
+
+    # skip the package __init__, it pulls the whole shell integration
+    package = imp.new_module('harvest')
+    package.__path__ = [os.path.abspath(PACKAGE_PATH)]
+    sys.modules['harvest'] = package
+
+    from harvest import settings
+    settings._settings = Settings()
+
+    # keep the user's harvest log out of it
+    from harvest import harvest_logger
+    harvest_logger._logger = logging.getLogger('harvest-benchmark')
+    harvest_logger._logger.addHandler(logging.NullHandler())
+
+
+def _peak():
+    """ peak resident memory of this process so far, in KB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Stages(object):
+
+    def __init__(self, count):
+        self._count = count
+        self._results = []
+
+    def measure(self, name, function, *args):
+        return self._measure(name, self._count, function, *args)
+
+    def measure_each(self, name, function, entries):
+        """ call function on every entry, timed per entry of the sample """
+        def each():
+            for entry in entries:
+                function(entry)
+        self._measure(name, len(entries), each)
+
+    def _measure(self, name, count, function, *args):
+        peak = _peak()
+        started = time.time()
+        result = function(*args)
+        elapsed = time.time() - started
+        size = None
+        if isinstance(result, str):
+            size = len(result)
+        elif isinstance(result, (int, long)):
+            size = result
+        self._results.append((name, count, elapsed, _peak() - peak, _peak(),
+                              size))
+        return result
+
+    def report(self):
+        print '%d entries' % self._count
+        print '  %-22s %10s %10s %10s %12s %10s' % \
+            ('stage', 'seconds', 'us/entry', 'KB grown', 'KB peak',
+             'bytes')
+        for name, count, elapsed, grown, peak, size in self._results:
+            print '  %-22s %10.3f %10.2f %10d %12d %10s' % \
+                (name, elapsed, elapsed / max(1, count) * 1e6,
+                 grown, peak, size if size is not None else '-')
+        sys.stdout.flush()
+
+
+def _stream(crop):
+    """ write the compressed crop to a file, as harvest does """
+    from harvest.compression import Compressor
+    with tempfile.TemporaryFile() as file:
+        output = Compressor(file)
+        crop.write(output)
+        output.close()
+        return file.tell()
+
+
+def _per_key_instance(entry):
+    """ the instance as it was extracted before the field table """
+    from harvest.crop import Instance, _bool, _int, _str
+    row = []
+    row.append(entry.get_object_id())
+    row.append(_int(entry.metadata.get('filesize', None)))
+    row.append(_int(entry.metadata.get('creation_time', None)))
+    row.append(_int(entry.metadata.get('timestamp', None)))
+    buddies = entry.metadata.get('buddies', None)
+    row.append(len(json.loads(buddies).values()) if buddies else None)
+    row.append(None)
+    row.append(_bool(entry.metadata.get('share-scope', None)))
+    row.append(_bool(entry.metadata.get('title_set_by_user', None)))
+    row.append(_bool(entry.metadata.get('keep', None)))
+    row.append(_str(entry.metadata.get('mime_type', None)))
+    launch_times = entry.metadata.get('launch-times', None)
+    row.append(map(_int, launch_times.split(', ')) if launch_times else [])
+    return Instance(entry.metadata.get('activity', ''), row)
+
+
+def run(count, seed):
+    journal = Journal(count, seed)
+    _install(journal)
+    from harvest.crop import Crop
+    from harvest.cursor import Cursor
+    from harvest.compression import compress
+
+    end = START + count
+    stages = Stages(count)
+
+    crop = Crop(start=START, end=end)
+    stages.measure('query (1 page)', journal.find,
+                   crop._query(), None, Crop.PAGE_SIZE, 0, Crop.PROPERTIES)
+    # extraction alone, before and after the field table, on a sample
+    sample = journal.find(crop._query(), None, min(count, SAMPLE_SIZE), 0,
+                          Crop.PROPERTIES)[0]
+    stages.measure_each('instance (per key)', _per_key_instance, sample)
+    stages.measure_each('instance (table)', crop._instance, sample)
+    del sample
+    stages.measure('activities', crop._activities)
+    stages.measure('collect', crop.collect)
+    # streamed first, the peak only grows
+    stages.measure('write (streamed)', _stream, crop)
+    classic = stages.measure('serialize', crop.serialize)
+    stages.measure('compress', compress, classic)
+    del classic
+
+    crop = Crop(start=START, end=end, columnar=True)
+    stages.measure('collect (columnar)', crop.collect)
+    columnar = stages.measure('serialize (columnar)', crop.serialize)
+    stages.measure('compress (columnar)', compress, columnar)
+    del columnar, crop
+
+    path = tempfile.mkdtemp()
+    try:
+        cursor = Cursor(os.path.join(path, 'cursor'), START)
+        stages.measure('cursor grow (all)', cursor.grow, end - 60)
+        stages.measure('cursor grow (delta)', cursor.grow, end)
+        stages.measure('cursor grow (idle)', cursor.grow, end)
+    finally:
+        shutil.rmtree(path)
+
+    stages.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', default='1000,10000,100000',
+                        help='comma separated journal sizes, '
+                             'default: %(default)s')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    for count in [int(count) for count in options.entries.split(',')]:
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run(count, options.seed)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    main()
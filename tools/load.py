@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" many simulated laptops uploading crops to a harvest server
+
+Every laptop is a real Harvest, with its own working path, settings and
+synthetic journal, the one of the benchmark growing as time goes by. It
+collects at every trigger and uploads through a plain HTTP stand-in for
+the Soup session, so the outbox, batches, chunks, capabilities and
+retries are those of the client. Its clock can be sped up to compress
+weeks into a short run.
+"""
+
+import os
+import sys
+import imp
+import time
+import random
+import shutil
+import httplib
+import urlparse
+import argparse
+import tempfile
+import threading
+import traceback
+
+import benchmark
+
+# how Soup reports a request that never got an answer
+IO_ERROR = 7
+
+# the settings, journal, identity and stats of the laptop of each thread
+_local = threading.local()
+# the working path of a Harvest is found from HOME, which is shared
+_home_lock = threading.Lock()
+
+
+class Local(object):
+    """ forwards to what the laptop of the calling thread has as name """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(getattr(_local, self._name), attribute)
+
+
+class Clock(object):
+    """ time as the laptops see it, scale real seconds for every second """
+
+    def __init__(self, start, scale):
+        self._start = start
+        self._scale = scale
+        self._started = time.time()
+
+    def time(self):
+        return self._start + (time.time() - self._started) / self._scale
+
+    def real(self, seconds):
+        return seconds * self._scale
+
+
+class Journal(benchmark.Journal):
+    """ the benchmark journal, with an entry for every period so far """
+
+    def __init__(self, clock, seed, spacing):
+        benchmark.Journal.__init__(self, 0, seed, spacing)
+        self._clock = clock
+
+    def find(self, *args, **kwargs):
+        self._count = int(self._clock.time() - benchmark.START) // \
+            self._spacing + 1
+        return benchmark.Journal.find(self, *args, **kwargs)
+
+
+class Settings(object):
+
+    def __init__(self, values):
+        self.values = values
+
+    def get_int(self, key):
+        return self.values.get(key, 0)
+
+    def get_bool(self, key):
+        return self.values.get(key, False)
+
+    def get_string(self, key):
+        return self.values.get(key)
+
+    def set_int(self, key, value):
+        self.values[key] = value
+
+    def set_string(self, key, value):
+        self.values[key] = value
+
+
+class Identity(object):
+
+    def __init__(self, serial_number):
+        self._serial_number = serial_number
+
+    def serial_number(self):
+        return self._serial_number
+
+    def build(self):
+        return 'load'
+
+    def updated(self):
+        return None
+
+
+class Headers(object):
+
+    def __init__(self, headers=None):
+        self._headers = dict((name.lower(), str(value))
+                             for name, value in (headers or {}).items())
+
+    def append(self, name, value):
+        self._headers[name.lower()] = value
+
+    def get_one(self, name):
+        return self._headers.get(name.lower())
+
+    def set_content_type(self, content_type, parameters):
+        self.append('Content-Type', content_type)
+
+    def set_content_length(self, length):
+        self.append('Content-Length', str(length))
+
+    def get_content_length(self):
+        return int(self.get_one('Content-Length') or 0)
+
+    def items(self):
+        return self._headers.items()
+
+
+class Body(object):
+
+    def __init__(self):
+        self._blocks = []
+        self.length = 0
+        self.completed = False
+
+    def set_accumulate(self, accumulate):
+        pass
+
+    def append(self, data):
+        self._blocks.append(data)
+        self.length += len(data)
+
+    def complete(self):
+        self.completed = True
+
+    def take(self):
+        """ what was appended since the last time """
+        blocks, self._blocks = self._blocks, []
+        return ''.join(blocks)
+
+
+class Message(object):
+    """ just what harvest uses of a Soup.Message """
+
+    def __init__(self, method, uri):
+        self.method = method
+        self.uri = uri
+        self.request_headers = Headers()
+        self.request_body = Body()
+        self.response_headers = Headers()
+        self.status_code = 0
+        self._handlers = {}
+
+    def set_request(self, content_type, use, data, length):
+        self.request_headers.set_content_type(content_type, None)
+        self.request_headers.set_content_length(length)
+        self.request_body.append(data[:length])
+        self.request_body.complete()
+
+    def connect(self, signal, callback):
+        self._handlers.setdefault(signal, []).append(callback)
+
+    def emit(self, signal):
+        for callback in self._handlers.get(signal, []):
+            callback(self)
+
+
+class Soup(object):
+
+    class URI(object):
+
+        @staticmethod
+        def new(uri):
+            return uri
+
+    class MemoryUse(object):
+        COPY = 2
+
+    class Status(object):
+        CANCELLED = 1
+
+    Message = Message
+
+
+class Results(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.outcomes = {}
+        self.bytes = 0
+
+    def request(self, status, latency, size):
+        with self._lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes += size
+
+    def outcome(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies) or [0]
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * fraction))]
+
+        print '%d requests in %.1fs (%.2f/s)' % \
+            (len(self.latencies), elapsed, len(self.latencies) / elapsed)
+        print 'uploaded %d KB (%.1f KB/s)' % \
+            (self.bytes / 1024, self.bytes / 1024.0 / elapsed)
+        print 'latency p50 %.3fs, p90 %.3fs, p99 %.3fs, max %.3fs' % \
+            (percentile(0.5), percentile(0.9), percentile(0.99),
+             latencies[-1])
+        print 'statuses %s' % self.statuses
+        print 'collections %s' % self.outcomes
+
+
+class Uploader(object):
+    """ sends harvest messages over httplib, in place of the Soup session
+
+    Streamed bodies are sent as they are fed, a block at a time.
+    """
+
+    def __init__(self, results, timeout):
+        self._results = results
+        self._timeout = timeout
+
+    def send(self, message):
+        url = urlparse.urlparse(message.uri)
+        started = time.time()
+        try:
+            connection = httplib.HTTPConnection(url.hostname, url.port,
+                                                timeout=self._timeout)
+            try:
+                self._request(connection, url.path, message)
+                response = connection.getresponse()
+                response.read()
+                message.status_code = response.status
+                message.response_headers = Headers(
+                    dict(response.getheaders()))
+            finally:
+                connection.close()
+        except Exception:
+            message.status_code = IO_ERROR
+            message.response_headers = Headers()
+        self._results.request(message.status_code, time.time() - started,
+                              message.request_body.length)
+        return message
+
+    def _request(self, connection, path, message):
+        connection.putrequest('POST', path)
+        for name, value in message.request_headers.items():
+            connection.putheader(name, value)
+        connection.endheaders()
+        message.emit('wrote-headers')
+        while True:
+            block = message.request_body.take()
+            if block:
+                connection.send(block)
+            if message.request_body.completed:
+                break
+            message.emit('wrote-chunk')
+        message.emit('finished')
+
+
+class Laptop(threading.Thread):
+
+    def __init__(self, number, options, clock, results, stop, home):
+        threading.Thread.__init__(self, name='Laptop-%d' % number)
+        self._number = number
+        self._options = options
+        self._clock = clock
+        self._results = results
+        self._stop = stop
+        self._home = home
+
+    def run(self):
+        from harvest.harvest import Harvest
+        from harvest.crop import Crop
+        from harvest.stats import Stats
+
+        options = self._options
+        _local.settings = Settings({
+            Harvest.HOSTNAME: options.url,
+            Harvest.API_KEY: options.api_key,
+            Harvest.FREQUENCY: options.period,
+            Crop.AGE_PATH: benchmark.START - 86400 * 365 * 10,
+            Crop.GENDER_PATH: 'female'})
+        _local.journal = Journal(self._clock, self._number, options.spacing)
+        _local.identity = Identity('SHC%08d' % self._number)
+        with _home_lock:
+            os.environ['HOME'] = self._home
+            _local.stats = Stats()
+            harvest = Harvest(sandbox=False)
+
+        # laptops are not turned on all at once, but close
+        self._stop.wait(random.random() * options.ramp)
+        while not self._stop.is_set():
+            try:
+                harvest.collect()
+                outcome = 'collected'
+            except Exception as error:
+                # the error itself tells nothing of the server
+                if error.__class__.__module__ != 'harvest.errors':
+                    traceback.print_exc()
+                outcome = error.__class__.__name__
+            self._results.outcome(outcome)
+            self._stop.wait(self._clock.real(options.trigger))
+
+
+def _call(function, *args):
+    # there is no main loop, every laptop thread is its own
+    function(*args)
+
+
+def _install(clock, results, timeout):
+    """ import the harvest package against the stand-ins """
+    benchmark._install(benchmark.Journal(0))
+    for name in ['Soup', 'GLib', 'GObject']:
+        if _missing('gi.repository.' + name):
+            module = imp.new_module('gi.repository.' + name)
+            module.threads_init = lambda: None
+            sys.modules['gi.repository.' + name] = module
+            setattr(sys.modules['gi.repository'], name, module)
+    if _missing('dbus.mainloop.glib'):
+        for name in ['dbus', 'dbus.mainloop', 'dbus.mainloop.glib']:
+            sys.modules[name] = imp.new_module(name)
+        sys.modules['dbus'].mainloop = sys.modules['dbus.mainloop']
+        sys.modules['dbus.mainloop'].glib = sys.modules['dbus.mainloop.glib']
+        sys.modules['dbus.mainloop.glib'].threads_init = lambda: None
+
+    from harvest import harvest
+    from harvest import capabilities
+    from harvest import identity
+    from harvest import journal
+    from harvest import settings
+    from harvest import stats
+    from harvest import uploader
+
+    harvest.Soup = uploader.Soup = Soup
+    harvest.call_in_main = _call
+    harvest.time = capabilities.time = clock
+    uploader._uploader = Uploader(results, timeout)
+    settings._settings = Local('settings')
+    journal.set_journal(Local('journal'))
+    identity._identity = Local('identity')
+    stats._stats = Local('stats')
+
+
+def _missing(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--api-key', default='secret')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--entries', type=int, default=500,
+                        help='journal entries of every laptop at the start')
+    parser.add_argument('--spacing', type=int, default=1800,
+                        help='seconds between journal entries')
+    parser.add_argument('--ramp', type=float, default=5,
+                        help='seconds over which the clients start')
+    parser.add_argument('--period', type=int, default=604800,
+                        help='seconds between collections')
+    parser.add_argument('--trigger', type=float, default=3600,
+                        help='seconds between collection triggers')
+    parser.add_argument('--time-scale', type=float, default=0.001,
+                        help='real seconds for every second of the laptops')
+    parser.add_argument('--timeout', type=float, default=60)
+    options = parser.parse_args()
+
+    results = Results()
+    clock = Clock(benchmark.START + options.entries * options.spacing,
+                  options.time_scale)
+    _install(clock, results, options.timeout)
+
+    path = tempfile.mkdtemp()
+    try:
+        started = time.time()
+        stop = threading.Event()
+        laptops = [Laptop(number, options, clock, results, stop,
+                          os.path.join(path, str(number)))
+                   for number in xrange(options.clients)]
+        for laptop in laptops:
+            laptop.start()
+        try:
+            time.sleep(options.duration)
+        finally:
+            # the collections in flight are let finish
+            stop.set()
+            for laptop in laptops:
+                laptop.join()
+        results.report(time.time() - started)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Martin Abente Lahaye. - tch@sugarlabs.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+""" local stand-in for the harvest server, for upload testing
+
+It speaks /rpc/store, /rpc/store/batch and /rpc/store/chunk, and can be
+made slow, lossy, bandwidth capped or busy.
+"""
+
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+STORE = '/rpc/store'
+BATCH = '/rpc/store/batch'
+CHUNK = '/rpc/store/chunk'
+BLOCK_SIZE = 4096
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
+class Stats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.crops = 0
+        self.bytes = 0
+        self.statuses = {}
+
+    def count(self, status, size=0, crops=0):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.crops += crops
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def report(self):
+        with self._lock:
+            elapsed = max(0.001, time.time() - self.started)
+            print '%.0fs: %d requests, %d crops (%.2f/s), %d KB ' \
+                  '(%.1f KB/s), statuses %s' % \
+                  (elapsed, self.requests, self.crops, self.crops / elapsed,
+                   self.bytes / 1024, self.bytes / 1024.0 / elapsed,
+                   json.dumps(self.statuses, sort_keys=True))
+            sys.stdout.flush()
+
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        HTTPServer.__init__(self, address, Handler)
+        self.options = options
+        self.stats = Stats()
+        self.uploads = {}
+        self.uploads_lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_POST(self):
+        options = self.server.options
+        body = self._read()
+        time.sleep(options.latency)
+
+        if self.headers.get('x-api-key') != options.api_key:
+            return self._reply(403)
+        if options.failure_rate and random.random() < options.failure_rate:
+            return self._reply(options.status, len(body))
+
+        path = self.path.split('?')[0]
+        if path == STORE:
+            self._store(body)
+        elif path == BATCH and options.batch:
+            self._batch(body)
+        elif path == CHUNK and options.chunks:
+            self._chunk(body)
+        else:
+            self._reply(404, len(body))
+
+    def _store(self, body):
+        if self._unsupported():
+            return self._reply(415, len(body))
+        crop = self._decode(body)
+        if crop is None:
+            return self._reply(400, len(body))
+        self._reply(200, len(body), 1)
+
+    def _batch(self, body):
+        if self._unsupported():
+            return self._reply(415, len(body))
+        crops = self._decode(body)
+        if not isinstance(crops, list):
+            return self._reply(400, len(body))
+        self._reply(200, len(body), len(crops))
+
+    def _chunk(self, body):
+        upload = self.headers.get('x-harvest-upload')
+        offset = int(self.headers.get('x-harvest-offset', 0))
+        size = int(self.headers.get('x-harvest-size', 0))
+        with self.server.uploads_lock:
+            received = self.server.uploads.setdefault(upload, [])
+            length = sum(len(piece) for piece in received)
+            if offset != length:
+                return self._reply(409, len(body),
+                                   headers={'x-harvest-offset': length})
+            received.append(body)
+            length += len(body)
+            if length < size:
+                return self._reply(200, len(body),
+                                   headers={'x-harvest-offset': length})
+            data = ''.join(self.server.uploads.pop(upload))
+
+        # the pieces are opaque, only the whole upload has an encoding
+        try:
+            if self.headers.get('x-harvest-encoding') == 'gzip':
+                data = zlib.decompress(data, GZIP_WBITS)
+            json.loads(data)
+        except (zlib.error, ValueError):
+            return self._reply(400, len(body))
+        self._reply(200, len(body), 1, {'x-harvest-offset': length})
+
+    def _read(self):
+        """ read the request body, no faster than the bandwidth cap """
+        length = int(self.headers.get('Content-Length', 0))
+        cap = self.server.options.bandwidth
+        pieces = []
+        while length > 0:
+            started = time.time()
+            piece = self.rfile.read(min(length, BLOCK_SIZE))
+            if not piece:
+                break
+            pieces.append(piece)
+            length -= len(piece)
+            if cap:
+                time.sleep(max(0, len(piece) / float(cap) -
+                               (time.time() - started)))
+        return ''.join(pieces)
+
+    def _unsupported(self):
+        # as a server that does not know gzip, the client plainly retries
+        return self.headers.get('Content-Encoding') == 'gzip' and \
+            not self.server.options.gzip
+
+    def _decode(self, body):
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = zlib.decompress(body, GZIP_WBITS)
+            return json.loads(body)
+        except (zlib.error, ValueError):
+            return None
+
+    def _reply(self, status, size=0, crops=0, headers=None):
+        options = self.server.options
+        self.server.stats.count(status, size, crops)
+        self.send_response(status)
+        if options.gzip:
+            self.send_header('Accept-Encoding', 'gzip')
+        if options.versions:
+            self.send_header('x-harvest-versions', options.versions)
+        self.send_header('x-harvest-batch', int(options.batch))
+        self.send_header('x-harvest-chunks', int(options.chunks))
+        if options.window:
+            self.send_header('x-harvest-window', options.window)
+        if status in [429, 503] and options.retry_after:
+            self.send_header('Retry-After', options.retry_after)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', 0)
+        self.end_headers()
+
+
+def _report(stats, interval):
+    while True:
+        time.sleep(interval)
+        stats.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--api-key', default='secret')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every response')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='fraction of requests that fail')
+    parser.add_argument('--status', type=int, default=503,
+                        help='status of the failed requests')
+    parser.add_argument('--retry-after', default='',
+                        help='Retry-After sent along 429 and 503, in '
+                             'seconds or as an HTTP date')
+    parser.add_argument('--window', type=int, default=0,
+                        help='retry window advertised to the clients')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='bytes per second read from each client')
+    parser.add_argument('--gzip', action='store_true',
+                        help='accept gzip encoded requests')
+    parser.add_argument('--batch', action='store_true',
+                        help='accept batches of crops')
+    parser.add_argument('--chunks', action='store_true',
+                        help='accept chunked uploads')
+    parser.add_argument('--versions', default='000312',
+                        help='crop versions advertised to the clients')
+    parser.add_argument('--report', type=int, default=10,
+                        help='seconds between statistics reports')
+    parser.add_argument('--verbose', action='store_true')
+    options = parser.parse_args()
+
+    server = Server((options.host, options.port), options)
+    reporter = threading.Thread(target=_report,
+                                args=(server.stats, options.report))
+    reporter.daemon = True
+    reporter.start()
+    print 'serving on http://%s:%d' % (options.host, options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stats.report()
+
+
+if __name__ == '__main__':
+    main()